@@ -0,0 +1,86 @@
+"""Audio source helpers for playback."""
+import threading
+import time
+from collections import deque
+
+import discord
+
+
+class PrewarmedSource(discord.AudioSource):
+    """Wraps an AudioSource and buffers its first frames ahead of playback.
+
+    `fill()` is meant to run in a worker thread before the source is handed to
+    the voice client: it makes FFmpeg connect, probe and decode the start of
+    the stream, so playback can begin without a gap. `read()` serves the
+    buffered frames first and then continues with the wrapped source.
+    """
+
+    def __init__(self, source: discord.AudioSource):
+        self.source = source
+        self._buffer: deque[bytes] = deque()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._eof = False
+
+    def fill(self, frames: int):
+        """Read up to `frames` frames (20 ms each) into the buffer."""
+        for _ in range(frames):
+            with self._lock:
+                if self._closed or self._eof:
+                    return
+                data = self.source.read()
+                if not data:
+                    self._eof = True
+                    return
+                self._buffer.append(data)
+
+    @property
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+    def read(self) -> bytes:
+        with self._lock:
+            if self._buffer:
+                return self._buffer.popleft()
+            if self._eof:
+                return b''
+            return self.source.read()
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    def cleanup(self):
+        with self._lock:
+            self._closed = True
+            self._buffer.clear()
+        self.source.cleanup()
+
+
+class TimedSource(discord.AudioSource):
+    """Wraps an AudioSource and reports the time until its first frame.
+
+    Created right after FFmpeg is spawned, so `on_first_frame(seconds)` gets
+    the spawn-to-first-packet latency, whether the first read happens on the
+    voice thread or while pre-warming.
+    """
+
+    def __init__(self, source: discord.AudioSource, on_first_frame):
+        self.source = source
+        self.on_first_frame = on_first_frame
+        self._started: float | None = time.perf_counter()
+
+    def read(self) -> bytes:
+        data = self.source.read()
+        if self._started is not None and data:
+            elapsed, self._started = time.perf_counter() - self._started, None
+            try:
+                self.on_first_frame(elapsed)
+            except Exception:
+                pass
+        return data
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
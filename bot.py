@@ -1,4 +1,11 @@
 # This example requires the 'message_content' intent.
+# Start the bot with main.py (see there).
+if __name__ == '__main__':
+    # `python bot.py` would make every spawned extraction worker run this
+    # whole module again; continue through main.py instead
+    import os
+    import sys
+    os.execv(sys.executable, [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')])
 
 from unittest import case
 import discord
@@ -6,37 +13,119 @@ from discord import app_commands
 from discord.ui import View, button
 import re
 import asyncio
+import hashlib
+import json
+import logging
 import os
-from utils import load_settings
-from services.youtube import extract_youtube, extract_playlist
-from services.spotify import is_spotify_url, resolve_spotify_title
-
+import time
+from itertools import islice
+from utils import SETTINGS_PATH, Settings, load_settings, read_settings
+from logs import setup_logging, set_levels
+from player import GuildPlayer
+from audio import PrewarmedSource, TimedSource
+from renderer import PlayerMessage
+from router import CommandRegistry, Context
+from scheduler import DeadlineScheduler
+from journal import QueueJournal, track_record
+from metrics import Registry
+from services.youtube import (
+    extract_youtube, extract_playlist_entries, resolve_stream, prefetch_streams,
+    set_track_cache, set_extraction_engine, extraction_pending, youtube_video_id,
+)
+from services.cache import TrackCache, AudioCache
+from services.loudness import LoudnessAnalyzer, gain_db
+from services.engine import ExtractionEngine, ExtractionError, ExtractionUnavailable
+from services.spotify import (
+    close_spotify, is_spotify_url, is_spotify_collection, resolve_spotify_title, resolve_spotify_tracks,
+)
+
+# immutable snapshot, swapped as a whole when settings.TOML changes (see watch_settings)
 settings = load_settings()
+# queue-based logging, levels per subsystem (see [logging] in settings.TOML)
+setup_logging(settings.logging, {'cluster': os.environ.get('CLUSTER_ID')})
+play_log = logging.getLogger('bot.play')
+extract_log = logging.getLogger('bot.extract')
+voice_log = logging.getLogger('bot.voice')
+idle_log = logging.getLogger('bot.idle')
+prewarm_log = logging.getLogger('bot.prewarm')
+commands_log = logging.getLogger('bot.commands')
+gateway_log = logging.getLogger('bot.gateway')
+
 # Prefer environment variable for token (e.g., in Docker), fallback to settings file
-BOT_TOKEN = os.environ.get("DISCORD_TOKEN") or (settings["bot"]["token"] if settings else "")
-PREFIX = "/"
-COMMANDS = {}
-if settings:
-    PREFIX = settings.get("bot", {}).get("prefix", PREFIX)
-    COMMANDS = settings.get("commands", {})
-
-# normalize command aliases: produce mapping of internal command -> list of aliases
-COMMAND_ALIASES: dict[str, list[str]] = {}
-for k, v in (COMMANDS or {}).items():
-    if isinstance(v, str):
-        COMMAND_ALIASES[k] = [v.lower()]
-    elif isinstance(v, list):
-        COMMAND_ALIASES[k] = [str(x).lower() for x in v]
+BOT_TOKEN = os.environ.get("DISCORD_TOKEN") or settings.bot.token
+# internal command -> prefix aliases; rebuilt on settings reload
+COMMAND_ALIASES = settings.commands
+
+# persistent track metadata cache (see [cache] in settings.TOML)
+CACHE_CFG = settings.cache
+track_cache: TrackCache | None = None
+if CACHE_CFG.enabled:
+    try:
+        track_cache = TrackCache(path=CACHE_CFG.path, ttl=CACHE_CFG.ttl, max_entries=CACHE_CFG.max_entries)
+        set_track_cache(track_cache)
+    except Exception as e:
+        logging.getLogger('bot.cache').error('Failed to open track cache: %s', e)
+
+# local Opus copies of frequently played tracks (see [audio_cache] in settings.TOML)
+AUDIO_CACHE_CFG = settings.audio_cache
+audio_cache: AudioCache | None = None
+if AUDIO_CACHE_CFG.enabled:
+    try:
+        audio_cache = AudioCache(
+            path=AUDIO_CACHE_CFG.path,
+            max_bytes=int(AUDIO_CACHE_CFG.max_size_mb * 1024 * 1024),
+            min_plays=AUDIO_CACHE_CFG.min_plays,
+            downloads=AUDIO_CACHE_CFG.downloads,
+        )
+    except Exception as e:
+        logging.getLogger('bot.cache').error('Failed to open audio cache: %s', e)
+# running audio cache downloads
+audio_cache_tasks: set[asyncio.Task] = set()
+
+# loudness normalization (see [loudness] in settings.TOML); measurements are
+# stored in the track cache
+loudness: LoudnessAnalyzer | None = None
+if settings.loudness.enabled:
+    if track_cache is not None:
+        loudness = LoudnessAnalyzer(track_cache, analyses=settings.loudness.analyses)
     else:
-        # fallback: use key itself
-        COMMAND_ALIASES[k] = [k]
+        logging.getLogger('bot.loudness').error('Loudness normalization needs the track cache ([cache] enabled)')
+# running loudness analyses
+loudness_tasks: set[asyncio.Task] = set()
+
+# yt-dlp extraction engine (see [extraction] in settings.TOML)
+EXTRACTION_CFG = settings.extraction
+EXTRACTION_ENGINE = ExtractionEngine(
+    workers=EXTRACTION_CFG.workers,
+    max_jobs_per_worker=EXTRACTION_CFG.max_jobs_per_worker,
+    max_queue=EXTRACTION_CFG.max_queue,
+    timeout=EXTRACTION_CFG.timeout,
+    retries=EXTRACTION_CFG.retries,
+    backoff=EXTRACTION_CFG.backoff,
+    breaker_threshold=EXTRACTION_CFG.breaker_threshold,
+    breaker_reset=EXTRACTION_CFG.breaker_reset,
+)
+set_extraction_engine(EXTRACTION_ENGINE)
 
 # Die Berechtigungen für den Bot
 intents = discord.Intents.default()
 intents.message_content = True
 
-client = discord.Client(intents=intents)
+# sharding (see [sharding] in settings.TOML); cluster.py passes each process
+# its shard range via SHARD_IDS / SHARD_COUNT / CLUSTER_ID
+SHARD_CFG = settings.sharding
+SHARD_IDS = [int(x) for x in os.environ.get('SHARD_IDS', '').split(',') if x.strip()] or None
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT') or SHARD_CFG.shard_count) or None
+CLUSTER_ID = os.environ.get('CLUSTER_ID')
+
+if SHARD_IDS or SHARD_CFG.enabled:
+    # shard_count None = use Discord's recommendation
+    client = discord.AutoShardedClient(intents=intents, shard_ids=SHARD_IDS, shard_count=SHARD_COUNT)
+else:
+    client = discord.Client(intents=intents)
 tree = app_commands.CommandTree(client)
+# commands defined once, exposed as slash and prefix commands
+registry = CommandRegistry()
 
 
 class PlayerView(View):
@@ -50,49 +139,10 @@ class PlayerView(View):
         vc = interaction.guild.voice_client
         if not vc or not vc.is_connected():
             return
-        gid = interaction.guild.id
         if vc.is_playing():
-            vc.pause()
-            # schedule pause-idle disconnect
-            bot_cfg = settings.get('bot', {}) if settings else {}
-            pause_idle = int(bot_cfg.get('pause_idle_timeout', 300))
-            if pause_idle != -1:
-                async def pause_wait():
-                    try:
-                        await asyncio.sleep(pause_idle)
-                        vc2 = interaction.guild.voice_client
-                        if vc2 and vc2.is_connected() and getattr(vc2, 'is_paused', lambda: False)() and not vc2.is_playing():
-                            try:
-                                msg = now_playing_message.pop(gid, None)
-                                if msg:
-                                    try:
-                                        await msg.delete()
-                                    except Exception:
-                                        pass
-                            except Exception:
-                                pass
-                            try:
-                                await vc2.disconnect()
-                                print(f"[pause-idle] Disconnected from guild {gid} after {pause_idle}s paused")
-                            except Exception as e:
-                                print('Pause-idle disconnect error:', e)
-                    finally:
-                        pause_idle_tasks.pop(gid, None)
-
-                # cancel existing pause-idle task
-                t = pause_idle_tasks.get(gid)
-                if t:
-                    t.cancel()
-                pause_idle_tasks[gid] = asyncio.create_task(pause_wait())
+            pause_playback(interaction.guild, vc)
         elif getattr(vc, 'is_paused', lambda: False)():
-            # resume -> cancel any pause-idle
-            t = pause_idle_tasks.pop(gid, None)
-            if t:
-                try:
-                    t.cancel()
-                except Exception:
-                    pass
-            vc.resume()
+            resume_playback(interaction.guild, vc)
 
     @discord.ui.button(label="Skip", style=discord.ButtonStyle.secondary)
     async def skip(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -103,43 +153,32 @@ class PlayerView(View):
         if not vc or not vc.is_connected():
             return
         user_id = interaction.user.id
-        votes = skip_votes.setdefault(gid, set())
+        player = get_player(gid)
+        votes = player.skip_votes
         if user_id in votes:
             # already voted; ignore duplicate
             return
         votes.add(user_id)
 
         # determine required count
-        bot_cfg = settings.get('bot', {}) if settings else {}
-        use_majority = bool(bot_cfg.get('skip_use_majority', False))
-        required = int(bot_cfg.get('skip_required', 1))
-        if use_majority:
+        required = settings.bot.skip_required
+        if settings.bot.skip_use_majority:
             # count non-bot members in the voice channel
             ch = vc.channel
             nonbots = [m for m in ch.members if not m.bot]
             required = (len(nonbots) // 2) + 1
 
-        # update player message embed with votes
-        msg = now_playing_message.get(gid)
+        # update player message embed with votes (coalesced)
         current = len(votes)
-        if msg:
-            try:
-                embed = msg.embeds[0] if msg.embeds else discord.Embed()
-                desc = embed.description or ''
-                # replace or append skip line
-                lines = [l for l in (desc.splitlines()) if not l.startswith('Skip votes:')]
-                lines.append(f'Skip votes: {current}/{required}')
-                embed.description = '\n'.join(lines)
-                await msg.edit(embed=embed)
-            except Exception:
-                pass
+        player.ui.update(skip_line=f'Skip votes: {current}/{required}')
 
         # if threshold reached, perform skip and notify publicly
         if current >= required:
             # announce skip
-            if msg and getattr(msg, 'channel', None):
+            channel = player.ui.channel
+            if channel:
                 try:
-                    await msg.channel.send(f'Skip passed ({current}/{required}) — skipping.')
+                    await channel.send(f'Skip passed ({current}/{required}) — skipping.')
                 except Exception:
                     pass
             try:
@@ -154,33 +193,24 @@ class PlayerView(View):
     async def show_queue(self, interaction: discord.Interaction, button: discord.ui.Button):
         # show queue as ephemeral message
         await interaction.response.defer(ephemeral=True)
-        q = queues.get(interaction.guild.id, [])
-        if not q:
+        player = players.get(interaction.guild.id)
+        if not player or not player.queue:
             await interaction.followup.send('Queue is empty.', ephemeral=True)
             return
         lines = []
-        for i, t in enumerate(q, start=1):
-            lines.append(f'{i}. {t.get("title")}')
-        msg = '\n'.join(lines[:50])
+        for i, t in enumerate(islice(player.queue, 50), start=1):
+            lines.append(f'{i}. {t.title}')
+        msg = '\n'.join(lines)
         await interaction.followup.send(f'Queue:\n{msg}', ephemeral=True)
 
     @discord.ui.button(label="Repeat", style=discord.ButtonStyle.secondary)
     async def repeat_toggle(self, interaction: discord.Interaction, button: discord.ui.Button):
         # toggle repeat for the guild; silent
         await interaction.response.defer()
-        gid = interaction.guild.id
-        cur = bool(repeat_flags.get(gid, False))
-        repeat_flags[gid] = not cur
+        player = get_player(interaction.guild.id)
+        player.set_repeat(not player.repeat)
         # update player message to indicate repeat status
-        msg = now_playing_message.get(gid)
-        if msg:
-            try:
-                embed = msg.embeds[0] if msg.embeds else discord.Embed()
-                footer_text = f"Repeat: {'ON' if repeat_flags[gid] else 'OFF'}"
-                embed.set_footer(text=footer_text)
-                await msg.edit(embed=embed, view=PlayerView())
-            except Exception:
-                pass
+        player.ui.update(footer=f"Repeat: {'ON' if player.repeat else 'OFF'}")
 
     @discord.ui.button(label="Stop", style=discord.ButtonStyle.danger)
     async def stop(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -189,55 +219,110 @@ class PlayerView(View):
         vc = interaction.guild.voice_client
         if not vc or not vc.is_connected():
             return
+        # drop queue, timers and player message, then leave
+        await leave_guild(interaction.guild)
+
+
+# --- Audio / playback helpers ---
+FFMPEG_BEFORE_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+FFMPEG_OPTIONS = '-vn'
+
+# per-guild player state (queue, votes, player message, timers, repeat)
+players: dict[int, GuildPlayer] = {}
+# idle / pause-idle disconnect deadlines of all guilds
+timers = DeadlineScheduler(resolution=1.0)
+
+# queues survive restarts and crashes (see [journal] in settings.TOML)
+JOURNAL_CFG = settings.journal
+journal: QueueJournal | None = None
+if JOURNAL_CFG.enabled:
+    _journal_path = JOURNAL_CFG.path
+    if CLUSTER_ID is not None:
+        # one journal per cluster process
+        _journal_path += f'.{CLUSTER_ID}'
+    journal = QueueJournal(_journal_path, compact_every=JOURNAL_CFG.compact_every)
+# guilds whose voice connection is restored at the same time
+RESTORE_CONCURRENCY = JOURNAL_CFG.restore_concurrency
+_restore_task: asyncio.Task | None = None
+
+# frames (20 ms each) buffered by a pre-warmed source
+PREWARM_BUFFER_FRAMES = 150
+# when extraction is unavailable, playback is retried after this many seconds
+EXTRACTION_RETRY_DELAY = EXTRACTION_CFG.breaker_reset
+
+# Prometheus metrics (see [metrics] in settings.TOML)
+METRICS_CFG = settings.metrics
+METRICS_ENABLED = METRICS_CFG.enabled
+metrics = Registry()
+EXTRACTION_LATENCY = metrics.histogram('bot_extraction_seconds', 'yt-dlp extraction latency')
+VOICE_CONNECT_LATENCY = metrics.histogram('bot_voice_connect_seconds', 'Voice channel connect time')
+FFMPEG_FIRST_PACKET = metrics.histogram('bot_ffmpeg_first_packet_seconds', 'FFmpeg spawn to first audio frame')
+TRACK_GAP = metrics.histogram('bot_track_gap_seconds', 'Silence between two tracks')
+REST_LATENCY = metrics.histogram('bot_discord_rest_seconds', 'Discord REST request latency')
+metrics.gauge('bot_voice_clients', 'Active voice connections', lambda: len(client.voice_clients))
+metrics.gauge('bot_queued_tracks', 'Tracks queued over all guilds', lambda: sum(len(p) for p in players.values()))
+metrics.gauge('bot_idle_timers', 'Pending idle / pause-idle disconnect timers', lambda: timers.pending)
+metrics.gauge('bot_extraction_pending', 'Extraction jobs queued or running', extraction_pending)
+
+if METRICS_ENABLED:
+    EXTRACTION_ENGINE.on_latency = EXTRACTION_LATENCY.observe
+    _http_request = client.http.request
+
+    async def timed_request(route, **kwargs):
+        with REST_LATENCY.time():
+            return await _http_request(route, **kwargs)
+
+    client.http.request = timed_request
+
+
+
+def get_player(gid: int) -> GuildPlayer:
+    """Return the player of guild `gid`, creating it if needed."""
+    player = players.get(gid)
+    if player is None:
+        player = players[gid] = GuildPlayer(gid)
+        player.ui = PlayerMessage(PlayerView, settings.bot.message_update_interval)
+        player.timers = timers
+        if journal is not None:
+            player.journal = journal
+            player.ui.on_send = lambda m: journal.record('ui', gid, c=m.channel.id, m=m.id)
+    return player
+
+
+def forget_player(player: GuildPlayer):
+    """Release a player's state and remove its guild from the queue journal."""
+    # detach first: the cleanup itself is not worth journaling
+    player.journal = None
+    player.cleanup()
+    if journal is not None and not client.is_closed():
+        journal.record('drop', player.guild_id)
+
+
+def release_player(gid: int):
+    """Drop all state of guild `gid` (cancels its timers and extractions)."""
+    player = players.pop(gid, None)
+    if player:
+        forget_player(player)
+    return player
+
+
+async def leave_guild(guild: discord.Guild):
+    """Stop playback, delete the player message, disconnect and release all state."""
+    player = players.pop(guild.id, None)
+    if player:
+        forget_player(player)
+        await player.ui.delete()
+    vc = guild.voice_client
+    if vc:
         try:
             if vc.is_playing() or getattr(vc, 'is_paused', lambda: False)():
                 vc.stop()
         except Exception:
             pass
-        queues.pop(interaction.guild.id, None)
-        # remove stored player message if exists
-        try:
-            gid = interaction.guild.id
-            msg = now_playing_message.pop(gid, None)
-            if msg:
-                try:
-                    await msg.delete()
-                except Exception:
-                    pass
-        except Exception:
-            pass
         try:
             await vc.disconnect()
-        except Exception:
-            pass
-        # cancel any pause-idle task
-        try:
-            t2 = pause_idle_tasks.pop(interaction.guild.id, None)
-            if t2:
-                try:
-                    t2.cancel()
-                except Exception:
-                    pass
-        except Exception:
-            pass
-
-
-# --- Audio / playback helpers ---
-FFMPEG_BEFORE_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
-FFMPEG_OPTIONS = '-vn'
-
-# simple per-guild queue
-queues: dict[int, list] = {}
-# skip vote tracking and current player message
-skip_votes: dict[int, set] = {}
-now_playing_message: dict[int, discord.Message] = {}
-# idle disconnect tasks per guild
-idle_tasks: dict[int, asyncio.Task] = {}
-# pause-idle tasks (when player is paused for too long)
-pause_idle_tasks: dict[int, asyncio.Task] = {}
-# repeat flag per guild (repeat current track)
-repeat_flags: dict[int, bool] = {}
-
+        except Exception as e:
+            voice_log.warning('Disconnect error: %s', e, extra={'guild': guild.id})
 
 
 async def extract_track_info(query: str):
@@ -246,7 +331,7 @@ async def extract_track_info(query: str):
 
     # if spotify, resolve to title and search youtube
     if is_spotify_url(query):
-        title = resolve_spotify_title(query)
+        title = await resolve_spotify_title(query)
         search = f'ytsearch1:{title}' if title else f'ytsearch1:{query}'
     else:
         # if a youtube URL, pass directly, otherwise treat as search
@@ -259,467 +344,934 @@ async def extract_track_info(query: str):
     if not info:
         return None
 
-    try:
-        print(f'[extract] Found track: {info.get("title")} -> {info.get("url")}')
-    except Exception:
-        pass
+    extract_log.debug('Found track: %s -> %s', info.get('title'), info.get('url'), extra={'track': info.get('webpage_url')})
 
     return info
 
 
-async def ensure_player_message(channel: discord.abc.Messageable, gid: int, embed: discord.Embed, view: View):
-    """Ensure there is exactly one player message in the channel for guild `gid`."""
-    stored = now_playing_message.get(gid)
-    if stored:
-        try:
-            # ensure it still exists and edit it in place
-            await stored.edit(embed=embed, view=view)
-            return stored
-        except discord.NotFound:
-            # stored was deleted, send new
-            new = await channel.send(embed=embed, view=view)
-            now_playing_message[gid] = new
-            return new
-        except Exception:
-            # on any other failure, attempt to recreate
+async def extract_tracks(query: str) -> list:
+    """Like extract_track_info, but expands Spotify albums/playlists into all their tracks."""
+    if not query:
+        return []
+    if not is_spotify_collection(query):
+        info = await extract_track_info(query)
+        return [info] if info else []
+
+    terms = await resolve_spotify_tracks(query)
+    sem = asyncio.Semaphore(max(1, settings.bot.spotify_concurrency))
+
+    async def search(term):
+        async with sem:
             try:
-                new = await channel.send(embed=embed, view=view)
-                now_playing_message[gid] = new
-                return new
-            except Exception:
-                return stored
-    else:
-        new = await channel.send(embed=embed, view=view)
-        now_playing_message[gid] = new
-        return new
+                return await extract_youtube(f'ytsearch1:{term}')
+            except ExtractionUnavailable:
+                raise
+            except Exception as e:
+                extract_log.warning('Search failed for %s: %s', term, e)
+                return None
+
+    results = await asyncio.gather(*(search(t) for t in terms))
+    tracks = [r for r in results if r]
+    extract_log.info('Expanded %s into %d/%d tracks', query, len(tracks), len(terms))
+    return tracks
+
+
+async def extract_for_guild(gid: int, query: str) -> list | None:
+    """Run extract_tracks on behalf of guild `gid`.
+
+    Returns None if the extraction was cancelled because the bot left voice in
+    that guild (the player's cleanup cancels it). Extraction errors propagate.
+    """
+    task = asyncio.create_task(extract_tracks(query))
+    tasks = get_player(gid).extractions
+    tasks.add(task)
+    try:
+        await asyncio.wait({task})
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        tasks.discard(task)
+    if task.cancelled():
+        return None
+    return task.result()
+
 
+# voice connects in progress; concurrent commands of a guild share one
+connecting: dict[int, asyncio.Task] = {}
 
-async def ensure_voice(interaction: discord.Interaction):
-    channel = None
-    if interaction.user and getattr(interaction.user, 'voice', None):
-        channel = interaction.user.voice.channel
+
+def is_busy(vc) -> bool:
+    return vc.is_playing() or getattr(vc, 'is_paused', lambda: False)()
+
+
+async def _connect(guild: discord.Guild, channel):
+    with VOICE_CONNECT_LATENCY.time():
+        vc = await channel.connect()
+    voice_log.info('Connected to %s in guild %s', channel, guild.id, extra={'guild': guild.id})
+    if journal is not None:
+        journal.record('voice', guild.id, c=channel.id)
+    return vc
+
+
+async def connect_voice(guild: discord.Guild, channel):
+    """Return a voice client in `channel`, reusing the guild's connection.
+
+    A connected client is moved over instead of reconnected, unless it is
+    playing for listeners in its current channel.
+    """
+    vc = guild.voice_client
+    if vc and vc.is_connected():
+        if vc.channel != channel and (not is_busy(vc) or not any(not m.bot for m in vc.channel.members)):
+            with VOICE_CONNECT_LATENCY.time():
+                await vc.move_to(channel)
+            voice_log.info('Moved to %s in guild %s', channel, guild.id, extra={'guild': guild.id})
+            if journal is not None:
+                journal.record('voice', guild.id, c=channel.id)
+        return vc
+    task = connecting.get(guild.id)
+    if task is None:
+        task = connecting[guild.id] = asyncio.create_task(_connect(guild, channel))
+        task.add_done_callback(lambda t: connecting.pop(guild.id, None) if connecting.get(guild.id) is t else None)
+    # a cancelled command must not abort a connect other commands wait for
+    return await asyncio.shield(task)
+
+
+async def ensure_voice(ctx: Context):
+    channel = ctx.voice_channel
     if not channel:
         return None, 'You are not in a voice channel.'
+    try:
+        return await connect_voice(ctx.guild, channel), None
+    except Exception as e:
+        return None, f'Failed to join voice channel: {e}'
+
+
+async def extract_joining(ctx: Context, extraction):
+    """Await `extraction` while joining the author's voice channel.
+
+    Time to first audio becomes the longer of the two instead of their sum.
+    Returns (result, vc, err); if joining fails first the extraction is
+    cancelled and result is None. If the extraction fails or finds nothing
+    it returns right away (vc None) and a connection made just for it is
+    closed once established. Extraction errors propagate.
+    """
+    guild = ctx.guild
+    fresh = not (guild.voice_client and guild.voice_client.is_connected())
+    joining = asyncio.create_task(ensure_voice(ctx))
+    searching = asyncio.ensure_future(extraction)
+    ok = False
+    try:
+        await asyncio.wait({joining, searching}, return_when=asyncio.FIRST_COMPLETED)
+        if joining.done() and joining.result()[1]:
+            searching.cancel()
+            return None, *joining.result()
+        result = await searching
+        ok = bool(result)
+        if not ok:
+            # report "nothing found" without waiting for the connect
+            return result, None, None
+        vc, err = await joining
+        return result, vc, err
+    finally:
+        if not searching.done():
+            searching.cancel()
+        if not ok and fresh:
+            joining.add_done_callback(lambda t: leave_unused(guild, t))
+
+
+def leave_unused(guild: discord.Guild, joining: asyncio.Task):
+    """Disconnect a connection nothing got queued for."""
+    if joining.cancelled() or joining.exception() or joining.result()[1]:
+        return
+    player = players.get(guild.id)
+    vc = guild.voice_client
+    # other searches of the guild may still be running
+    if vc and not is_busy(vc) and (player is None or not (player.current or player.queue or player.extractions)):
+        task = asyncio.create_task(leave_guild(guild))
+        voice_tasks.add(task)
+        task.add_done_callback(voice_tasks.discard)
 
-    vc = interaction.guild.voice_client
-    if not vc or not vc.is_connected():
+
+# leave_guild calls started from callbacks
+voice_tasks: set[asyncio.Task] = set()
+
+
+async def play_next_for_guild(guild: discord.Guild):
+    """Wake the guild's playback loop, starting it if it is not running.
+
+    Safe to call any time (track enqueued, track ended, retry): the loop
+    itself decides whether there is something to start.
+    """
+    player = players.get(guild.id)
+    if player is None:
+        # guild was torn down (stop / disconnect)
+        return
+    if player.task is None or player.task.done():
+        player.task = asyncio.create_task(playback_loop(guild, player))
+    player.wakeup.set()
+
+
+async def playback_loop(guild: discord.Guild, player: GuildPlayer):
+    """Per-guild playback task: starts the next track whenever it is woken up.
+
+    The voice client's `after` callback only hands the event back to the
+    loop, so the audio thread never waits on extraction or Discord I/O.
+    Errors are contained to this guild.
+    """
+    while players.get(guild.id) is player:
+        await player.wakeup.wait()
+        player.wakeup.clear()
+        vc = guild.voice_client
+        if not vc or not vc.is_connected():
+            continue
+        if vc.is_playing() or getattr(vc, 'is_paused', lambda: False)():
+            continue
         try:
-            vc = await channel.connect()
-            print(f"[voice] Connected to {channel} in guild {interaction.guild.id}")
+            await start_next_track(guild, player, vc)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            return None, f'Failed to join voice channel: {e}'
-    return vc, None
+            play_log.exception('Guild %s playback error: %s', guild.id, e, extra={'guild': guild.id})
 
 
-async def play_next_for_guild(guild: discord.Guild):
-    q = queues.get(guild.id, [])
-    if not q:
-        # schedule idle disconnect
-        bot_cfg = settings.get('bot', {}) if settings else {}
-        idle = int(bot_cfg.get('idle_timeout', 120))
-        if idle == -1:
-            return
+def schedule_idle_disconnect(guild: discord.Guild, player: GuildPlayer):
+    idle = settings.bot.idle_timeout
+    if idle == -1:
+        return
+
+    async def expired():
+        vc = guild.voice_client
+        p = players.get(guild.id)
+        if (not p or not p.queue) and vc and vc.is_connected() and not vc.is_playing():
+            await leave_guild(guild)
+            idle_log.info('Disconnected from guild %s after %ss idle', guild.id, idle, extra={'guild': guild.id})
+
+    # replaces a pending idle deadline
+    player.schedule_idle(idle, expired)
+
+
+def pause_playback(guild: discord.Guild, vc: discord.VoiceClient):
+    """Pause and schedule the pause-idle disconnect."""
+    vc.pause()
+    pause_idle = settings.bot.pause_idle_timeout
+    if pause_idle == -1:
+        return
+
+    async def expired():
+        vc2 = guild.voice_client
+        if vc2 and vc2.is_connected() and getattr(vc2, 'is_paused', lambda: False)() and not vc2.is_playing():
+            await leave_guild(guild)
+            idle_log.info('Disconnected from guild %s after %ss paused', guild.id, pause_idle, extra={'guild': guild.id})
+
+    get_player(guild.id).schedule_pause_idle(pause_idle, expired)
+
+
+def resume_playback(guild: discord.Guild, vc: discord.VoiceClient):
+    """Resume and cancel the pause-idle disconnect."""
+    player = players.get(guild.id)
+    if player:
+        player.cancel_pause_idle()
+    vc.resume()
+
+
+def track_video_id(track) -> str | None:
+    return track.get('id') or youtube_video_id(track.get('webpage_url') or '')
 
-        async def idle_wait():
+
+async def cached_audio(track) -> str | None:
+    """Local file of `track` in the audio cache, if any."""
+    if audio_cache is None:
+        return None
+    return await asyncio.to_thread(audio_cache.lookup, track_video_id(track))
+
+
+async def record_play(track, url: str | None):
+    """Count a play for the audio cache and download the track once it is popular.
+
+    Also queues a loudness analysis for tracks that have not been measured.
+    """
+    video_id = track_video_id(track)
+    if (audio_cache is not None and await asyncio.to_thread(audio_cache.record_play, video_id)
+            and url and url.startswith(('http://', 'https://'))):
+        task = asyncio.create_task(audio_cache.store(video_id, url, is_opus_stream(track)))
+        audio_cache_tasks.add(task)
+        task.add_done_callback(audio_cache_tasks.discard)
+    duration = track.get('duration')
+    if (loudness is not None and url and duration and duration <= settings.loudness.max_duration
+            and await loudness.wants(video_id)):
+        task = asyncio.create_task(loudness.analyze(video_id, url))
+        loudness_tasks.add(task)
+        task.add_done_callback(loudness_tasks.discard)
+
+
+async def track_gain(track) -> float | None:
+    """Normalization gain (dB) for `track`; None if not measured or too small to matter."""
+    if loudness is None:
+        return None
+    measured = await loudness.measured(track_video_id(track))
+    if measured is None:
+        return None
+    cfg = settings.loudness
+    gain = gain_db(*measured, cfg.target, cfg.true_peak, cfg.max_gain)
+    return gain if abs(gain) >= cfg.min_gain else None
+
+
+def is_opus_stream(track) -> bool:
+    return str(track.get('acodec') or '').startswith('opus')
+
+
+async def _open_source(track, url: str) -> tuple[discord.AudioSource, str]:
+    """Open an audio source for `url`; returns the source and the path taken.
+
+    Opus streams (YouTube's usual WebM/Opus formats) are passed through with
+    codec copy, so neither FFmpeg nor discord.py has to decode and re-encode
+    them. Streams without codec metadata are probed first; anything else is
+    transcoded to PCM as before. Files from the audio cache are local
+    Ogg/Opus and copied as well. A measured loudness gain is a volume filter,
+    which needs decoding: those tracks are re-encoded to Opus by FFmpeg.
+    """
+    gain = await track_gain(track)
+    options = FFMPEG_OPTIONS if gain is None else f'{FFMPEG_OPTIONS} -af volume={gain:.2f}dB'
+    if not url.startswith(('http://', 'https://')):
+        if gain is None:
+            return discord.FFmpegOpusAudio(url, codec='copy', options=options), 'opus-cache'
+        return discord.FFmpegOpusAudio(url, bitrate=128, options=options), 'opus-encode'
+    if settings.bot.opus_passthrough:
+        codec = 'opus' if is_opus_stream(track) else None
+        bitrate = None
+        if codec is None and not track.get('acodec'):
             try:
-                await asyncio.sleep(idle)
-                vc = guild.voice_client
-                q2 = queues.get(guild.id, [])
-                if (not q2 or len(q2) == 0) and vc and vc.is_connected() and not vc.is_playing():
-                    try:
-                        # delete player message if present
-                        try:
-                            msg = now_playing_message.pop(guild.id, None)
-                            if msg:
-                                try:
-                                    await msg.delete()
-                                except Exception:
-                                    pass
-                        except Exception:
-                            pass
-                        await vc.disconnect()
-                        print(f"[idle] Disconnected from guild {guild.id} after {idle}s idle")
-                    except Exception as e:
-                        print('Idle disconnect error:', e)
-            finally:
-                idle_tasks.pop(guild.id, None)
-
-        # cancel existing task
-        t = idle_tasks.get(guild.id)
-        if t:
-            t.cancel()
-        idle_tasks[guild.id] = asyncio.create_task(idle_wait())
+                codec, bitrate = await discord.FFmpegOpusAudio.probe(url)
+            except Exception as e:
+                play_log.warning('Probe failed for %s: %s', track.get('title'), e, extra={'track': track.get('webpage_url')})
+        if codec == 'opus' and gain is None:
+            source = discord.FFmpegOpusAudio(url, codec='copy', before_options=FFMPEG_BEFORE_OPTIONS, options=options)
+            return source, 'opus-copy'
+        if codec:
+            # still let FFmpeg encode Opus instead of encoding PCM in-process
+            source = discord.FFmpegOpusAudio(url, bitrate=bitrate or 128, before_options=FFMPEG_BEFORE_OPTIONS, options=options)
+            return source, 'opus-encode'
+    return discord.FFmpegPCMAudio(url, before_options=FFMPEG_BEFORE_OPTIONS, options=options), 'pcm'
+
+
+async def create_source(track, url: str) -> tuple[discord.AudioSource, str]:
+    source, path = await _open_source(track, url)
+    if METRICS_ENABLED:
+        source = TimedSource(source, FFMPEG_FIRST_PACKET.observe)
+    return source, path
+
+
+async def open_prewarmed(track, url: str) -> tuple[PrewarmedSource, str]:
+    source, path = await create_source(track, url)
+    source = PrewarmedSource(source)
+    # blocking (FFmpeg connect + first frames); run in a thread
+    await asyncio.to_thread(source.fill, PREWARM_BUFFER_FRAMES)
+    return source, path
+
+
+async def prewarm_next(guild: discord.Guild, player: GuildPlayer):
+    """Open and buffer the next track's source shortly before the current one ends."""
+    track = player.next_track()
+    if track is None or player.prewarm is not None:
         return
-    track = q.pop(0)
-    vc = guild.voice_client
-    if not vc or not vc.is_connected():
+    try:
+        url = await cached_audio(track) or await resolve_stream(track)
+        if not url:
+            return
+        opening = asyncio.ensure_future(open_prewarmed(track, url))
+        try:
+            source, path = await asyncio.shield(opening)
+        except asyncio.CancelledError:
+            # skipped/stopped while FFmpeg was starting: close it once it is up
+            opening.add_done_callback(lambda f: f.cancelled() or f.exception() or f.result()[0].cleanup())
+            raise
+    except Exception as e:
+        prewarm_log.warning('Guild %s failed for %s: %s', guild.id, track.title, e, extra={'guild': guild.id, 'track': track.webpage_url})
         return
-
-    source_url = track.get('url')
-    if not source_url:
-        # skip if no source
-        await play_next_for_guild(guild)
+    if players.get(guild.id) is not player or player.next_track() is not track:
+        # stopped or queue changed meanwhile
+        source.cleanup()
+        return
+    player.prewarm = (source, path)
+    player.prewarm_track = track
+    prewarm_log.debug('Guild %s ready: %s (%d frames, %s)', guild.id, track.title, source.buffered, path,
+                      extra={'guild': guild.id, 'track': track.webpage_url})
+
+
+def schedule_prewarm(guild: discord.Guild, player: GuildPlayer, duration: float | None):
+    player.discard_prewarm()
+    # gapless mode: open and buffer the next track this many seconds before the
+    # current one ends (0 = off)
+    ahead = settings.bot.prewarm_seconds
+    if ahead <= 0 or not duration:
         return
 
-    # cancel idle task if present
-    t = idle_tasks.pop(guild.id, None)
-    if t:
-        try:
-            t.cancel()
-        except Exception:
-            pass
-    # cancel pause-idle task if present (we are starting playback)
-    t2 = pause_idle_tasks.pop(guild.id, None)
-    if t2:
+    def start():
+        player.prewarm_timer = None
+        player.prewarm_task = asyncio.create_task(prewarm_next(guild, player))
+
+    delay = max(0.0, float(duration) - ahead)
+    player.prewarm_timer = asyncio.get_running_loop().call_later(delay, start)
+
+
+async def start_next_track(guild: discord.Guild, player: GuildPlayer, vc: discord.VoiceClient):
+    # take tracks until one resolves to a playable stream
+    source = None
+    while True:
+        track = player.dequeue()
+        if track is None:
+            player.discard_prewarm()
+            schedule_idle_disconnect(guild, player)
+            return
+        # gapless: the source may already be open and buffered
+        prewarmed = player.take_prewarmed(track)
+        if prewarmed is not None:
+            source, path = prewarmed
+            source_url = track.url
+            break
+        # popular tracks may be stored locally: no extraction, no remote connection
+        source_url = await cached_audio(track)
+        if source_url:
+            break
+        # resolve (or refresh an expiring) stream URL just before playing
         try:
-            t2.cancel()
-        except Exception:
-            pass
+            source_url = await resolve_stream(track)
+        except ExtractionUnavailable as e:
+            # upstream is down: keep the track and try again once the breaker resets
+            play_log.warning('Guild %s waiting for extraction to recover: %s', guild.id, e, extra={'guild': guild.id})
+            player.drop_current()
+            player.push_front(track)
+            await asyncio.sleep(EXTRACTION_RETRY_DELAY)
+            player.wakeup.set()
+            return
+        except Exception as e:
+            play_log.warning('Failed to resolve %s: %s', track.webpage_url, e, extra={'guild': guild.id, 'track': track.webpage_url})
+            source_url = None
+        if not vc.is_connected():
+            return
+        if source_url:
+            break
+        # skip if no source
+        player.drop_current()
 
-    print(f"[play] Guild {guild.id} playing: {track.get('title')} ({source_url})")
+    # warm up stream URLs for the next few tracks
+    prefetch_streams(player.queue, settings.bot.prefetch_ahead)
 
-    # reset skip votes and update player message
-    skip_votes[guild.id] = set()
-    embed = discord.Embed(title='Now Playing', description=f"{track.get('title')}\n\nSkip votes: 0/{int(settings.get('bot', {}).get('skip_required', 1))}")
-    # footer: repeat status
-    try:
-        if repeat_flags.get(guild.id, False):
-            embed.set_footer(text='Repeat: ON')
-        else:
-            embed.set_footer(text='Repeat: OFF')
-    except Exception:
-        pass
-    try:
-        # update or recreate player message (moves to bottom if needed)
-        msg = await ensure_player_message(now_playing_message[guild.id].channel, guild.id, embed, PlayerView()) if now_playing_message.get(guild.id) else await ensure_player_message(guild.text_channels[0], guild.id, embed, PlayerView())
-    except Exception:
-        pass
+    # cancel idle / pause-idle timers (we are starting playback)
+    player.cancel_idle()
+    player.cancel_pause_idle()
+
+    loop = asyncio.get_running_loop()
 
     def after_play(error):
+        # runs on the audio thread: only hand the event over to the loop
         if error:
-            print('Player error:', error)
-        # handle repeat: if enabled, re-insert the same track at front
-        try:
-            if repeat_flags.get(guild.id, False):
-                queues.setdefault(guild.id, []).insert(0, track)
-        except Exception:
-            pass
-        # schedule next
-        fut = asyncio.run_coroutine_threadsafe(play_next_for_guild(guild), client.loop)
-        try:
-            fut.result()
-        except Exception:
-            pass
+            play_log.error('Player error: %s', error, extra={'guild': guild.id})
+        loop.call_soon_threadsafe(player.track_ended)
 
-    player = discord.FFmpegPCMAudio(source_url, before_options=FFMPEG_BEFORE_OPTIONS, options=FFMPEG_OPTIONS)
+    if source is None:
+        source, path = await create_source(track, source_url)
+    player.audio_path = path
     try:
-        vc.play(player, after=after_play)
+        vc.play(source, after=after_play)
     except Exception as e:
-        print('Failed to play:', e)
-
+        play_log.error('Failed to play: %s', e, extra={'guild': guild.id, 'track': track.webpage_url})
+        source.cleanup()
+        player.drop_current()
+        player.wakeup.set()
+        return
+    gap = player.mark_started()
+    await record_play(track, source_url)
+    if gap is not None:
+        TRACK_GAP.observe(gap)
+    schedule_prewarm(guild, player, track.duration)
+    gap_text = f' after {gap * 1000:.0f} ms' if gap is not None else ''
+    play_log.info('Guild %s playing: %s%s [%s]', guild.id, track.title, gap_text, path,
+                  extra={'guild': guild.id, 'track': track.webpage_url})
 
-@tree.command(name='skip', description='Skip current track')
-async def slash_skip(interaction: discord.Interaction):
-    vc = interaction.guild.voice_client
+    # reset skip votes and update player message
+    player.skip_votes.clear()
+    player.ui.update(
+        # fallback channel, only used if no command has set one yet
+        channel=None if player.ui.channel or not guild.text_channels else guild.text_channels[0],
+        title='Now Playing',
+        body=track.title,
+        skip_line=f"Skip votes: 0/{settings.bot.skip_required}",
+        footer=f"Repeat: {'ON' if player.repeat else 'OFF'}",
+    )
+
+
+@registry.command('skip', 'Skip current track')
+async def cmd_skip(ctx: Context):
+    vc = ctx.guild.voice_client
     if not vc or not vc.is_connected():
-        await interaction.response.send_message('Bot is not in voice channel.', ephemeral=True)
+        await ctx.send('Bot is not in voice channel.', ephemeral=True)
         return
     if vc.is_playing():
         vc.stop()
-        await interaction.response.send_message('Skipped.', ephemeral=True)
+        await ctx.send('Skipped.', ephemeral=True)
     else:
-        await interaction.response.send_message('Nothing is playing.', ephemeral=True)
+        await ctx.send('Nothing is playing.', ephemeral=True)
 
 
-@tree.command(name='queue', description='Show the current queue')
-async def slash_queue(interaction: discord.Interaction):
-    await interaction.response.defer(ephemeral=False)
-    q = queues.get(interaction.guild.id, [])
-    if not q:
-        await interaction.followup.send('Queue is empty.')
+@registry.command('queue', 'Show the current queue')
+async def cmd_queue(ctx: Context):
+    await ctx.defer()
+    player = players.get(ctx.guild.id)
+    if not player or not player.queue:
+        await ctx.send('Queue is empty.')
         return
     lines = []
-    for i, t in enumerate(q, start=1):
-        lines.append(f'{i}. {t.get("title")}')
-    msg = '\n'.join(lines[:50])
-    await interaction.followup.send(f'Queue:\n{msg}')
+    for i, t in enumerate(islice(player.queue, 50), start=1):
+        lines.append(f'{i}. {t.title}')
+    msg = '\n'.join(lines)
+    await ctx.send(f'Queue:\n{msg}')
 
 
-@tree.command(name='help', description='Show basic help')
-async def slash_help(interaction: discord.Interaction):
-    await interaction.response.send_message('Available slash commands: /play, /pause, /resume, /skip, /queue, /help', ephemeral=True)
+@registry.command('help', 'Show basic help')
+async def cmd_help(ctx: Context):
+    if ctx.is_slash:
+        names = [f'/{c.name}' for c in registry.commands.values() if c.slash]
+        await ctx.send('Available slash commands: ' + ', '.join(names), ephemeral=True)
+    else:
+        prefix = settings.bot.prefix
+        available = [f'{prefix}{v[0]}' for k, v in COMMAND_ALIASES.items() if v and k in registry.commands]
+        await ctx.send('Available commands: ' + ', '.join(available))
 
 
-@tree.command(name='hello', description='Say hello')
-async def slash_hello(interaction: discord.Interaction):
-    await interaction.response.send_message(f'Hello, {interaction.user.display_name}!')
+@registry.command('hello', 'Say hello')
+async def cmd_hello(ctx: Context):
+    await ctx.send(f'Hello, {ctx.author.display_name}!')
 
 
-@tree.command(name='pause', description='Pause playback')
-async def slash_pause(interaction: discord.Interaction):
-    vc = interaction.guild.voice_client
+@registry.command('pause', 'Pause playback')
+async def cmd_pause(ctx: Context):
+    guild = ctx.guild
+    vc = guild.voice_client
     if not vc or not vc.is_connected():
-        await interaction.response.send_message('Bot is not in voice channel.', ephemeral=True)
+        await ctx.send('Bot is not in voice channel.', ephemeral=True)
         return
     if vc.is_playing():
-        vc.pause()
-        # schedule pause-idle disconnect
-        bot_cfg = settings.get('bot', {}) if settings else {}
-        pause_idle = int(bot_cfg.get('pause_idle_timeout', 300))
-        gid = interaction.guild.id
-        if pause_idle != -1:
-            async def pause_wait():
-                try:
-                    await asyncio.sleep(pause_idle)
-                    vc2 = interaction.guild.voice_client
-                    if vc2 and vc2.is_connected() and getattr(vc2, 'is_paused', lambda: False)() and not vc2.is_playing():
-                        try:
-                            msg = now_playing_message.pop(gid, None)
-                            if msg:
-                                try:
-                                    await msg.delete()
-                                except Exception:
-                                    pass
-                        except Exception:
-                            pass
-                        try:
-                            await vc2.disconnect()
-                            print(f"[pause-idle] Disconnected from guild {gid} after {pause_idle}s paused")
-                        except Exception as e:
-                            print('Pause-idle disconnect error:', e)
-                finally:
-                    pause_idle_tasks.pop(gid, None)
-
-            t = pause_idle_tasks.get(gid)
-            if t:
-                t.cancel()
-            pause_idle_tasks[gid] = asyncio.create_task(pause_wait())
-        await interaction.response.send_message('Paused.', ephemeral=True)
+        pause_playback(guild, vc)
+        await ctx.send('Paused.', ephemeral=True)
     else:
-        await interaction.response.send_message('Nothing is playing.', ephemeral=True)
+        await ctx.send('Nothing is playing.', ephemeral=True)
 
 
-@tree.command(name='resume', description='Resume playback')
-async def slash_resume(interaction: discord.Interaction):
-    vc = interaction.guild.voice_client
+@registry.command('resume', 'Resume playback')
+async def cmd_resume(ctx: Context):
+    vc = ctx.guild.voice_client
     if not vc or not vc.is_connected():
-        await interaction.response.send_message('Bot is not in voice channel.', ephemeral=True)
+        await ctx.send('Bot is not in voice channel.', ephemeral=True)
         return
     if getattr(vc, 'is_paused', lambda: False)():
-        vc.resume()
-        # cancel any pause-idle task
-        t = pause_idle_tasks.pop(interaction.guild.id, None)
-        if t:
-            try:
-                t.cancel()
-            except Exception:
-                pass
-        await interaction.response.send_message('Resumed.', ephemeral=True)
+        resume_playback(ctx.guild, vc)
+        await ctx.send('Resumed.', ephemeral=True)
     else:
-        await interaction.response.send_message('Player is not paused.', ephemeral=True)
+        await ctx.send('Player is not paused.', ephemeral=True)
 
-@client.event
-async def on_ready():
-    print(f'We have logged in as {client.user}')
-    try:
-        # If you set a test_guild_id in settings.TOML the bot will sync commands
-        # to that guild (fast). Otherwise it will sync globally (can take minutes).
-        test_guild = None
-        if settings:
-            tg = settings.get("bot", {}).get("test_guild_id")
-            if tg:
-                try:
-                    test_guild = discord.Object(id=int(tg))
-                except Exception:
-                    test_guild = None
 
-        if test_guild:
-            await tree.sync(guild=test_guild)
-            print(f'Slash commands synced to guild {test_guild.id}.')
-        else:
-            await tree.sync()
-            print('Slash commands synced.')
-    except Exception as e:
-        print('Failed to sync slash commands:', e)
-
-
-# Example slash command for music play (stub)
-@tree.command(name="play", description="Play a song or URL")
-@app_commands.describe(query="Song name or URL")
-async def slash_play(interaction: discord.Interaction, query: str | None = None):
-    # send an immediate ephemeral acknowledgement to avoid the "thinking" indicator
-    query_text = (query or "").strip()
+@registry.command('play', 'Play a song or URL', param='query', param_description='Song name or URL')
+async def cmd_play(ctx: Context, query: str | None = None):
+    query_text = (query or '').strip()
     if not query_text:
-        await interaction.response.send_message('Please provide a search term or URL.', ephemeral=True)
+        await ctx.send('Please provide a search term or URL.', ephemeral=True)
         return
-    # quick ack
-    await interaction.response.send_message(f'Queued: {query_text}', ephemeral=True)
+    # quick ack, so slash commands don't show the "thinking" indicator
+    await ctx.send(f'Queued: {query_text}', ephemeral=True)
 
-    info = await extract_track_info(query_text)
-    if not info:
+    gid = ctx.guild.id
+    try:
+        # search and join voice at the same time
+        tracks, vc, err = await extract_joining(ctx, extract_for_guild(gid, query_text))
+    except ExtractionUnavailable as e:
+        await ctx.send(str(e), ephemeral=True)
+        return
+    except ExtractionError as e:
+        extract_log.warning('Failed for %s: %s', query_text, e, extra={'guild': gid})
+        tracks, err = [], None
+    if err:
+        if not ctx.guild.voice_client:
+            release_player(gid)
+        await ctx.send(err, ephemeral=True)
+        return
+    if tracks is None:
+        # bot left voice while we were searching
+        return
+    if not tracks:
         try:
-            await interaction.followup.send('Could not find the requested track.', ephemeral=True)
+            await ctx.send('Could not find the requested track.', ephemeral=True)
         except Exception:
             pass
         return
 
-    gid = interaction.guild.id
-    queues.setdefault(gid, [])
-    queues[gid].append(info)
+    player = get_player(gid)
+    player.enqueue(tracks)
 
     # cancel idle disconnect if scheduled
-    t = idle_tasks.pop(gid, None)
-    if t:
-        try:
-            t.cancel()
-        except Exception:
-            pass
+    player.cancel_idle()
 
-    # ensure voice connection
-    vc, err = await ensure_voice(interaction)
-    if err:
-        await interaction.followup.send(err, ephemeral=True)
-        return
+    desc = tracks[0].get('title') if len(tracks) == 1 else f'{len(tracks)} tracks'
+    player.ui.update(channel=ctx.channel, title='Queued', body=desc, skip_line=None)
 
     # if nothing is playing, start
     if not vc.is_playing() and not (getattr(vc, 'is_paused', lambda: False)()):
-        await play_next_for_guild(interaction.guild)
+        await play_next_for_guild(ctx.guild)
 
 
-@tree.command(name="playlist", description="Queue all tracks from a YouTube playlist URL")
-@app_commands.describe(url="YouTube playlist URL")
-async def slash_playlist(interaction: discord.Interaction, url: str):
-    await interaction.response.defer(ephemeral=True)
+@registry.command('playlist', 'Queue all tracks from a YouTube playlist URL', param='url',
+                  required=True, param_description='YouTube playlist URL')
+async def cmd_playlist(ctx: Context, url: str):
+    await ctx.defer(ephemeral=True)
+    url = (url or '').strip()
     if not url:
-        await interaction.followup.send('Please provide a playlist URL.', ephemeral=True)
+        await ctx.send('Please provide a playlist URL.', ephemeral=True)
         return
 
-    # extract playlist entries
-    tracks = await extract_playlist(url)
-    if not tracks:
-        await interaction.followup.send('No tracks found in playlist.', ephemeral=True)
+    gid = ctx.guild.id
+    # flat listing only (one request, no per-track extraction), joining voice meanwhile
+    try:
+        entries, vc, err = await extract_joining(ctx, extract_playlist_entries(url))
+    except ExtractionUnavailable as e:
+        await ctx.send(str(e), ephemeral=True)
+        return
+    except Exception as e:
+        extract_log.warning('Playlist extraction failed for %s: %s', url, e, extra={'guild': gid})
+        entries, err = [], None
+    if err:
+        if not ctx.guild.voice_client:
+            release_player(gid)
+        await ctx.send(err, ephemeral=True)
+        return
+    if not entries:
+        await ctx.send('No tracks found in playlist.', ephemeral=True)
         return
 
-    gid = interaction.guild.id
-    queues.setdefault(gid, [])
-    queues[gid].extend(tracks)
+    total = len(entries)
+    # only lightweight references go into the queue
+    player = get_player(gid)
+    player.enqueue(entries)
 
     # cancel idle disconnect if scheduled
-    t = idle_tasks.pop(gid, None)
-    if t:
-        try:
-            t.cancel()
-        except Exception:
-            pass
-
-    # ensure voice connection
-    vc, err = await ensure_voice(interaction)
-    if err:
-        await interaction.followup.send(err, ephemeral=True)
-        return
+    player.cancel_idle()
 
     # create/update player message
-    embed = discord.Embed(title="Playlist queued", description=f"Queued {len(tracks)} tracks from playlist")
-    view = PlayerView()
-    channel = interaction.channel
-    try:
-        await ensure_player_message(channel, gid, embed, view)
-    except Exception:
-        pass
+    player.ui.update(channel=ctx.channel, title='Playlist queued',
+                     body=f'Queued {total} tracks from playlist', skip_line=None)
 
-    # start playback if idle
+    # start playback if idle; stream URLs are resolved just in time
     if not vc.is_playing() and not (getattr(vc, 'is_paused', lambda: False)()):
-        await play_next_for_guild(interaction.guild)
+        await play_next_for_guild(ctx.guild)
+    else:
+        prefetch_streams(player.queue, settings.bot.prefetch_ahead)
+
+    await ctx.send(f'Queued {total} tracks.', ephemeral=True)
+
+
+# every command above is available as /<name> and via its [commands] aliases
+registry.install(tree)
+registry.build_index(COMMAND_ALIASES)
+
+
+# --- settings hot reload ---
+settings_log = logging.getLogger('bot.settings')
+# sections only read at startup
+RESTART_SECTIONS = ('cache', 'audio_cache', 'journal', 'extraction', 'sharding', 'metrics')
+# keys only read at startup
+RESTART_KEYS = (('bot', 'token'), ('bot', 'test_guild_id'), ('bot', 'application_id'),
+                ('bot', 'force_command_sync'), ('loudness', 'enabled'), ('loudness', 'analyses'),
+                ('logging', 'format'))
+_settings_task: asyncio.Task | None = None
+# seconds between checks of settings.TOML while reloading is off
+SETTINGS_OFF_POLL = 60.0
+
+
+def apply_settings(new: Settings):
+    """Swap in a new settings snapshot; readers see the old or the new one, never a mix."""
+    global settings, COMMAND_ALIASES
+    old = settings
+    pending = [name for name in RESTART_SECTIONS if getattr(new, name) != getattr(old, name)]
+    pending += [f'{section}.{key}' for section, key in RESTART_KEYS
+                if getattr(getattr(new, section), key) != getattr(getattr(old, section), key)]
+
+    # everything that can fail happens before the swap
+    index = registry.make_index(new.commands)
+    if new.logging != old.logging:
+        set_levels(new.logging, old.logging)
+
+    registry.index = index
+    settings = new
+    COMMAND_ALIASES = new.commands
+    if new.bot.message_update_interval != old.bot.message_update_interval:
+        for player in players.values():
+            player.ui.min_interval = new.bot.message_update_interval
+    settings_log.info('Reloaded %s', SETTINGS_PATH)
+    if pending:
+        settings_log.warning('Changes to %s take effect after a restart', ', '.join(pending))
+
+
+def _settings_version(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+async def watch_settings(path: str = SETTINGS_PATH):
+    """Reload settings.TOML whenever it changes, without a restart.
+
+    Polls the file's mtime every `settings_reload_interval` seconds. A file
+    that does not parse or validate is reported and the current settings stay.
+    While the interval is 0 changes are ignored, except one that turns
+    reloading back on; the file is then checked every SETTINGS_OFF_POLL seconds.
+    """
+    version = _settings_version(path)
+    while True:
+        interval = settings.bot.settings_reload_interval
+        await asyncio.sleep(interval if interval > 0 else SETTINGS_OFF_POLL)
+        current = _settings_version(path)
+        if current == version or current is None:
+            continue
+        version = current
+        try:
+            new = await asyncio.to_thread(read_settings, path)
+            if settings.bot.settings_reload_interval <= 0 and new.bot.settings_reload_interval <= 0:
+                continue
+            apply_settings(new)
+        except Exception as e:
+            settings_log.error('Keeping current settings, %s is invalid: %s', path, e)
 
-    await interaction.followup.send(f'Queued {len(tracks)} tracks.', ephemeral=True)
 
-    embed = discord.Embed(title="Queued", description=f"{info.get('title')}")
-    view = PlayerView()
-    channel = interaction.channel
-    try:
-        msg = await ensure_player_message(channel, gid, embed, view)
-    except Exception:
-        # fallback to followup send
-        msg = await interaction.followup.send(embed=embed, view=view)
-        now_playing_message[gid] = msg
+# last synced command tree hash per scope, so reconnects/restarts skip tree.sync()
+COMMAND_SYNC_STATE = 'cache/command_sync.json'
+# set to true (or FORCE_COMMAND_SYNC=1) to sync even if the tree is unchanged
+FORCE_COMMAND_SYNC = settings.bot.force_command_sync or os.environ.get('FORCE_COMMAND_SYNC') == '1'
 
-@client.event
-async def on_message(message):
-    if message.author == client.user:
-        return
-    # handle prefix commands using aliases from settings
-    if not message.content.startswith(PREFIX):
-        return
 
-    parts = message.content[len(PREFIX):].strip().split()
-    if not parts:
-        return
-    cmd = parts[0].lower()
-    args = parts[1:]
-
-    # find which internal command this alias maps to
-    matched = None
-    for internal, aliases in COMMAND_ALIASES.items():
-        if cmd in aliases:
-            matched = internal
-            break
+def command_tree_hash(guild: discord.abc.Snowflake | None = None) -> str:
+    """Stable hash of the commands tree.sync() would upload for this scope."""
+    payload = []
+    for cmd in tree.get_commands(guild=guild):
+        try:
+            payload.append(cmd.to_dict(tree))
+        except TypeError:
+            # discord.py < 2.4
+            payload.append(cmd.to_dict())
+    payload.sort(key=lambda c: (c.get('type', 1), c.get('name', '')))
+    data = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def load_sync_state() -> dict:
+    try:
+        with open(COMMAND_SYNC_STATE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
 
-    if not matched:
-        return
 
-    # implement a few simple prefix-command handlers
-    if matched == 'hello':
-        await message.channel.send('Hello!')
-    elif matched == 'help':
-        available = []
-        for k, v in COMMAND_ALIASES.items():
-            available.append(f"{PREFIX}{v[0]}")
-        await message.channel.send('Available commands: ' + ', '.join(available))
-    elif matched == 'play':
-        query = ' '.join(args).strip()
-        if not query:
-            await message.channel.send('Bitte suche nach einem Song oder gib eine URL an.')
+def save_sync_state(state: dict):
+    try:
+        os.makedirs(os.path.dirname(COMMAND_SYNC_STATE), exist_ok=True)
+        tmp = COMMAND_SYNC_STATE + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+        os.replace(tmp, COMMAND_SYNC_STATE)
+    except Exception as e:
+        commands_log.warning('Failed to store command sync state: %s', e)
+
+
+# per-cluster status file read by cluster.py
+CLUSTER_STATUS_DIR = 'cache/cluster'
+CLUSTER_STATUS_INTERVAL = SHARD_CFG.status_interval
+_status_task: asyncio.Task | None = None
+
+
+def cluster_status() -> dict:
+    shards = {}
+    for shard_id, latency in getattr(client, 'latencies', [(0, client.latency)]):
+        # latency is NaN until the first heartbeat
+        shards[str(shard_id)] = round(latency * 1000) if latency == latency else None
+    return {
+        'cluster': CLUSTER_ID,
+        'pid': os.getpid(),
+        'shards': shards,
+        'guilds': len(client.guilds),
+        'voice_clients': len(client.voice_clients),
+        'players': len(players),
+        'queued': sum(len(p) for p in players.values()),
+        'updated': time.time(),
+    }
+
+
+async def report_cluster_status():
+    path = os.path.join(CLUSTER_STATUS_DIR, f'{CLUSTER_ID}.json')
+    os.makedirs(CLUSTER_STATUS_DIR, exist_ok=True)
+    while True:
+        try:
+            tmp = path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(cluster_status(), f)
+            os.replace(tmp, path)
+        except Exception as e:
+            gateway_log.warning('Failed to write cluster status: %s', e)
+        await asyncio.sleep(CLUSTER_STATUS_INTERVAL)
+
+
+def journal_snapshot():
+    """Current state of every guild with something queued, for journal compaction."""
+    for gid, player in players.items():
+        if player.current is None and not player.queue:
+            continue
+        guild = client.get_guild(gid)
+        vc = guild.voice_client if guild else None
+        msg = player.ui.message
+        yield gid, {
+            't': [track_record(t) for t in player.queue],
+            'cur': track_record(player.current) if player.current is not None else None,
+            'repeat': player.repeat,
+            'c': vc.channel.id if vc and vc.channel else None,
+            'tc': msg.channel.id if msg else None,
+            'm': msg.id if msg else None,
+        }
+
+
+async def restore_guild(gid: int, state, limit: asyncio.Semaphore):
+    """Reconnect one guild and rebuild its queue from the journal."""
+    async with limit:
+        guild = client.get_guild(gid)
+        channel = guild.get_channel(state.voice_channel) if guild and state.voice_channel else None
+        if not isinstance(channel, (discord.VoiceChannel, discord.StageChannel)):
+            voice_log.info('Not restoring queue of guild %s: voice channel is gone', gid, extra={'guild': gid})
             return
-        await message.channel.send(f'Queued: {query}')
-        info = await extract_track_info(query)
-        if not info:
-            await message.channel.send('Konnte Track nicht finden.')
+        if gid in players:
+            # someone started a new queue before the old one was restored
+            return
+        try:
+            # shares the connect with commands issued meanwhile in this guild
+            await connect_voice(guild, channel)
+        except Exception as e:
+            voice_log.warning('Failed to rejoin %s in guild %s: %s', channel, gid, e, extra={'guild': gid})
             return
-        gid = message.guild.id
-        queues.setdefault(gid, [])
-        queues[gid].append(info)
+        if gid in players:
+            # a new queue was started while connecting; it owns the guild now
+            return
+        player = get_player(gid)
+        # the journal already holds this state; it is rewritten by the compaction below
+        player.journal = None
+        player.enqueue(([state.current] if state.current else []) + state.queue)
+        player.repeat = state.repeat
+        player.journal = journal
+        text = guild.get_channel_or_thread(state.text_channel) if state.text_channel else None
+        if text is not None:
+            player.ui.channel = text
+            if state.message:
+                # edited in place once playback starts, re-sent if it was deleted
+                player.ui.message = text.get_partial_message(state.message)
+        voice_log.info('Restored %d queued tracks in guild %s', len(player), gid, extra={'guild': gid})
+        # stream URLs are resolved lazily by the playback loop
+        await play_next_for_guild(guild)
 
-        # cancel idle disconnect if scheduled
-        t = idle_tasks.pop(gid, None)
-        if t:
-            try:
-                t.cancel()
-            except Exception:
-                pass
 
-        # ensure voice connection using message context
-        channel = None
-        if message.author and getattr(message.author, 'voice', None):
-            channel = message.author.voice.channel
-        if not channel:
-            await message.channel.send('Du musst in einem Voice-Channel sein.')
-            return
-        vc = message.guild.voice_client
-        if not vc or not vc.is_connected():
-            try:
-                vc = await channel.connect()
-                print(f"[voice] Connected to {channel} in guild {message.guild.id}")
-            except Exception as e:
-                await message.channel.send(f'Fehler beim Joinen des Voice-Channels: {e}')
-                return
-        # send a player message with controls (store for updates)
+async def restore_queues():
+    """Restore the queues journaled before the last shutdown or crash."""
+    states = journal.load()
+    if states:
+        voice_log.info('Restoring queues of %d guilds', len(states))
+        limit = asyncio.Semaphore(RESTORE_CONCURRENCY)
+        results = await asyncio.gather(*(restore_guild(gid, s, limit) for gid, s in states.items()),
+                                       return_exceptions=True)
+        for gid, result in zip(states, results):
+            if isinstance(result, Exception):
+                voice_log.error('Failed to restore guild %s: %s', gid, result, extra={'guild': gid})
+    # guilds that could not be restored are dropped from the journal here
+    journal.snapshot = journal_snapshot
+    await journal.compact()
+
+
+@client.event
+async def on_ready():
+    global _status_task, _restore_task, _settings_task
+    shards = f' (cluster {CLUSTER_ID}, shards {getattr(client, "shard_ids", None)})' if CLUSTER_ID is not None else ''
+    gateway_log.info('Logged in as %s%s', client.user, shards)
+    if CLUSTER_ID is not None and _status_task is None:
+        _status_task = asyncio.create_task(report_cluster_status())
+    if METRICS_ENABLED and not metrics.serving:
+        # one port per cluster process
+        port = METRICS_CFG.port + int(CLUSTER_ID or 0)
         try:
-            embed = discord.Embed(title='Queued', description=f"{info.get('title')}")
-            msg = await ensure_player_message(message.channel, gid, embed, PlayerView())
-        except Exception:
-            pass
+            await metrics.serve(METRICS_CFG.host, port)
+        except Exception as e:
+            logging.getLogger('bot.metrics').error('Failed to start server: %s', e)
+    if _settings_task is None:
+        # also runs while reloading is off, to notice it being turned back on
+        _settings_task = asyncio.create_task(watch_settings())
+    if journal is not None and _restore_task is None:
+        # on_ready fires again after reconnects: restore only once
+        _restore_task = asyncio.create_task(restore_queues())
+    if SHARD_IDS and 0 not in SHARD_IDS:
+        # commands are global: only the cluster owning shard 0 syncs them
+        return
+    try:
+        # If you set a test_guild_id in settings.TOML the bot will sync commands
+        # to that guild (fast). Otherwise it will sync globally (can take minutes).
+        tg = settings.bot.test_guild_id
+        test_guild = discord.Object(id=tg) if tg else None
+
+        # on_ready also fires after reconnects: only sync when the tree changed
+        scope = f'{client.application_id}:' + (f'guild:{test_guild.id}' if test_guild else 'global')
+        digest = command_tree_hash(test_guild)
+        state = load_sync_state()
+        if not FORCE_COMMAND_SYNC and state.get(scope) == digest:
+            commands_log.info('Slash commands unchanged (%s), skipping sync.', scope)
+            return
+
+        if test_guild:
+            await tree.sync(guild=test_guild)
+            commands_log.info('Slash commands synced to guild %s.', test_guild.id)
+        else:
+            await tree.sync()
+            commands_log.info('Slash commands synced.')
+        state[scope] = digest
+        save_sync_state(state)
+    except Exception as e:
+        commands_log.error('Failed to sync slash commands: %s', e)
+
+
+@client.event
+async def on_voice_state_update(member, before, after):
+    # the bot left voice (stop, idle timeout, kicked): release all guild state,
+    # which also abandons pending searches
+    if client.user and member.id == client.user.id and before.channel and not after.channel:
+        release_player(member.guild.id)
+
+
+@client.event
+async def on_message(message):
+    # runs for every message the bot can see: reject non-commands as cheaply as possible
+    prefix = settings.bot.prefix
+    if not message.content.startswith(prefix) or message.author.bot or message.guild is None:
+        return
+    try:
+        await registry.dispatch(message, prefix)
+    except Exception as e:
+        commands_log.exception('%r failed: %s', message.content[:50], e, extra={'guild': message.guild.id, 'user': message.author.id})
+
+
+async def run():
+    try:
+        async with client:
+            await client.start(BOT_TOKEN)
+    finally:
+        # the session belongs to this loop, close it before the loop goes away
+        await close_spotify()
 
-        if not vc.is_playing() and not (getattr(vc, 'is_paused', lambda: False)()):
-            await play_next_for_guild(message.guild)
 
-client.run(BOT_TOKEN)
+def main():
+    # like client.run(), minus its log handler: logging is already set up (queue handler)
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,170 @@
+"""Run the bot as several processes, each owning a contiguous range of shards.
+
+    python3 cluster.py --clusters 4 [--shards 16]
+
+Every cluster is a normal bot process (main.py) started with SHARD_IDS,
+SHARD_COUNT and CLUSTER_ID in its environment; all of them read the same
+settings.TOML. Crashed clusters are restarted, and the status files the
+clusters write (cache/cluster/<id>.json) are printed periodically.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+from utils import load_settings
+
+API_BASE = 'https://discord.com/api/v10'
+STATUS_DIR = 'cache/cluster'
+
+
+def recommended_shards(token: str) -> int:
+    """Shard count Discord recommends for this bot (GET /gateway/bot)."""
+    req = urllib.request.Request(f'{API_BASE}/gateway/bot', headers={
+        'Authorization': f'Bot {token}',
+        'User-Agent': 'DiscordBot (cluster launcher, 1.0)',
+    })
+    with urllib.request.urlopen(req, timeout=10) as r:
+        return int(json.load(r)['shards'])
+
+
+def shard_ranges(shard_count: int, clusters: int) -> list[list[int]]:
+    """Split shard ids 0..shard_count-1 into `clusters` contiguous ranges."""
+    clusters = max(1, min(clusters, shard_count))
+    size, extra = divmod(shard_count, clusters)
+    ranges, start = [], 0
+    for i in range(clusters):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+class Cluster:
+    def __init__(self, cluster_id: int, shard_ids: list[int], shard_count: int):
+        self.id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.proc: subprocess.Popen | None = None
+        self.restarts = 0
+        self.started_at = 0.0
+
+    def start(self):
+        env = dict(os.environ,
+                   CLUSTER_ID=str(self.id),
+                   SHARD_IDS=','.join(map(str, self.shard_ids)),
+                   SHARD_COUNT=str(self.shard_count))
+        self.proc = subprocess.Popen([sys.executable, 'main.py'], env=env)
+        self.started_at = time.monotonic()
+        print(f'[cluster] Started cluster {self.id} (pid {self.proc.pid}, shards '
+              f'{self.shard_ids[0]}-{self.shard_ids[-1]} of {self.shard_count})')
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def stop(self, timeout: float = 10):
+        if not self.alive():
+            return
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+    def status(self) -> dict:
+        try:
+            with open(os.path.join(STATUS_DIR, f'{self.id}.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+
+def print_status(clusters: list[Cluster]):
+    now = time.time()
+    for c in clusters:
+        s = c.status()
+        state = 'up' if c.alive() else 'down'
+        if not s:
+            print(f'[cluster] {c.id}: {state}, no status yet, restarts={c.restarts}')
+            continue
+        age = now - s.get('updated', 0)
+        latency = ', '.join(f'{k}:{v}ms' for k, v in s.get('shards', {}).items())
+        print(f"[cluster] {c.id}: {state}, guilds={s.get('guilds')} voice={s.get('voice_clients')} "
+              f"queued={s.get('queued')} restarts={c.restarts} age={age:.0f}s shards=[{latency}]")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Run the bot as multiple shard clusters.')
+    p.add_argument('--clusters', type=int, help='number of processes (default: [sharding] clusters)')
+    p.add_argument('--shards', type=int, help="total shards (default: [sharding] shard_count, 0 = Discord's recommendation)")
+    p.add_argument('--status-interval', type=float, help='seconds between status reports')
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    settings = load_settings()
+    cfg = settings.sharding
+    clusters = args.clusters or cfg.clusters
+    shard_count = args.shards or cfg.shard_count
+    interval = args.status_interval or cfg.status_interval
+
+    if not shard_count:
+        token = os.environ.get('DISCORD_TOKEN') or settings.bot.token
+        try:
+            shard_count = recommended_shards(token)
+        except Exception as e:
+            print('[cluster] Could not fetch recommended shard count:', e)
+            sys.exit(1)
+    # at least one shard per cluster
+    shard_count = max(shard_count, clusters)
+
+    # stale status files would show clusters that no longer exist
+    os.makedirs(STATUS_DIR, exist_ok=True)
+    for name in os.listdir(STATUS_DIR):
+        os.remove(os.path.join(STATUS_DIR, name))
+
+    group = [Cluster(i, ids, shard_count) for i, ids in enumerate(shard_ranges(shard_count, clusters))]
+    print(f'[cluster] {shard_count} shards in {len(group)} clusters')
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    # stagger the starts: Discord allows one identify per 5 s (per concurrency bucket)
+    for c in group:
+        c.start()
+        time.sleep(5)
+
+    next_report = time.monotonic() + interval
+    while not stopping:
+        time.sleep(1)
+        for c in group:
+            if stopping or c.alive():
+                continue
+            print(f'[cluster] Cluster {c.id} exited with {c.proc.returncode}')
+            # back off if it keeps crashing right after start
+            if time.monotonic() - c.started_at < 30:
+                time.sleep(min(60, 5 * (c.restarts + 1)))
+            c.restarts += 1
+            c.start()
+        if time.monotonic() >= next_report:
+            print_status(group)
+            next_report = time.monotonic() + interval
+
+    print('[cluster] Stopping clusters...')
+    for c in group:
+        c.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""Append-only journal of queue changes, so queues survive restarts and crashes."""
+import asyncio
+import json
+import logging
+import os
+import threading
+
+log = logging.getLogger('bot.journal')
+
+# fields kept per track; stream URLs expire and are re-resolved before playing
+TRACK_FIELDS = ('id', 'title', 'webpage_url', 'duration')
+
+
+def track_record(track) -> dict:
+    return {k: track.get(k) for k in TRACK_FIELDS if track.get(k) is not None}
+
+
+class GuildState:
+    """Replayed state of one guild."""
+    __slots__ = ('queue', 'current', 'repeat', 'voice_channel', 'text_channel', 'message')
+
+    def __init__(self):
+        self.queue: list[dict] = []
+        self.current: dict | None = None
+        self.repeat = False
+        self.voice_channel: int | None = None
+        self.text_channel: int | None = None
+        self.message: int | None = None
+
+
+class QueueJournal:
+    """JSON-lines journal of queue mutations per guild.
+
+    Every mutation is one appended line (`record()`), written straight
+    through so a crash loses at most the line being written. `load()`
+    replays the file into GuildState objects. After `compact_every` records
+    the file is rewritten as one snapshot line per guild (`compact()`), taken
+    from the live players via the `snapshot` callable. The snapshot is taken
+    on the event loop; encoding and replacing the file run in a thread, and
+    records made meanwhile are carried over into the new file.
+
+    Ops: add (tracks), pop, front (track), end (repeat), clear, repeat,
+    voice (channel), ui (channel, message), drop, snap (full state).
+    """
+
+    def __init__(self, path: str = 'cache/queues.journal', compact_every: int = 5000):
+        self.path = path
+        self.compact_every = compact_every
+        self.snapshot = None
+        self._records = 0
+        self._file = None
+        # guards _file and _backlog against the compaction thread
+        self._lock = threading.Lock()
+        # records made while a compaction is running, None otherwise
+        self._backlog: list[str] | None = None
+        self._compaction: asyncio.Task | None = None
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def load(self) -> dict[int, GuildState]:
+        """Replay the journal; a torn last line (crash while writing) is ignored."""
+        states: dict[int, GuildState] = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    try:
+                        self._apply(states, rec)
+                    except Exception as e:
+                        log.warning('Skipping bad journal record %r: %s', line[:80], e)
+        except FileNotFoundError:
+            pass
+        return {gid: s for gid, s in states.items() if s.queue or s.current}
+
+    @staticmethod
+    def _apply(states, rec):
+        op, gid = rec['op'], rec['g']
+        if op == 'drop':
+            states.pop(gid, None)
+            return
+        s = states.get(gid)
+        if s is None:
+            s = states[gid] = GuildState()
+        if op == 'add':
+            s.queue.extend(rec['t'])
+        elif op == 'pop':
+            s.current = s.queue.pop(0) if s.queue else None
+        elif op == 'front':
+            s.queue.insert(0, rec['t'])
+        elif op == 'end':
+            if s.current is not None and rec.get('repeat'):
+                s.queue.insert(0, s.current)
+            s.current = None
+        elif op == 'clear':
+            s.queue.clear()
+            s.current = None
+        elif op == 'repeat':
+            s.repeat = rec['v']
+        elif op == 'voice':
+            s.voice_channel = rec['c']
+        elif op == 'ui':
+            s.text_channel, s.message = rec['c'], rec['m']
+        elif op == 'snap':
+            s.queue = rec['t']
+            s.current = rec.get('cur')
+            s.repeat = rec.get('repeat', False)
+            s.voice_channel = rec.get('c')
+            s.text_channel, s.message = rec.get('tc'), rec.get('m')
+
+    def record(self, op: str, guild_id: int, **fields):
+        line = json.dumps({'op': op, 'g': guild_id, **fields}, separators=(',', ':')) + '\n'
+        try:
+            with self._lock:
+                if self._file is None:
+                    self._file = self._open()
+                self._file.write(line)
+                self._file.flush()
+                if self._backlog is not None:
+                    self._backlog.append(line)
+                self._records += 1
+        except Exception as e:
+            log.warning('Journal write failed: %s', e)
+            return
+        if self.snapshot is not None and self._records >= self.compact_every and self._compaction is None:
+            self._compaction = asyncio.create_task(self.compact())
+            self._compaction.add_done_callback(self._compacted)
+
+    def _compacted(self, task: asyncio.Task):
+        self._compaction = None
+
+    def _open(self):
+        f = open(self.path, 'a+b')
+        # terminate a torn last line, or the next record would be glued to it
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+        f.close()
+        return open(self.path, 'a', encoding='utf-8')
+
+    async def compact(self):
+        """Rewrite the journal as one snapshot record per guild."""
+        if self.snapshot is None or self._backlog is not None:
+            # not set up yet, or another compaction is running
+            return
+        try:
+            # the players change while the file is written: copy their state now
+            snapshot = list(self.snapshot())
+            with self._lock:
+                self._backlog = []
+            await asyncio.to_thread(self._rewrite, snapshot)
+        except Exception as e:
+            with self._lock:
+                self._backlog = None
+            log.warning('Journal compaction failed: %s', e)
+
+    def _rewrite(self, snapshot):
+        # runs in a thread; the old file stays complete until it is replaced
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                for gid, rec in snapshot:
+                    f.write(json.dumps({'op': 'snap', 'g': gid, **rec}, separators=(',', ':')) + '\n')
+                with self._lock:
+                    # records made since the snapshot follow it in the new file
+                    f.writelines(self._backlog)
+                    f.close()
+                    if self._file is not None:
+                        self._file.close()
+                        self._file = None
+                    os.replace(tmp, self.path)
+                    self._records = len(self._backlog)
+        finally:
+            with self._lock:
+                self._backlog = None
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
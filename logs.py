@@ -0,0 +1,118 @@
+"""Logging setup: queue-based, optionally JSON, per-subsystem levels.
+
+Every subsystem logs to `logging.getLogger('bot.<subsystem>')` (e.g.
+`bot.play`, `bot.extract`). Records only get put on a queue in the calling
+thread (event loop or audio thread); a listener thread formats them and
+writes to stdout, so slow log sinks never stall playback or commands.
+Context such as the guild goes into `extra` and ends up as JSON fields:
+
+    log.info('Playing %s', title, extra={'guild': guild.id, 'track': url})
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+from utils import LoggingSettings
+
+ROOT_LOGGER = 'bot'
+# context fields copied from `extra` into JSON output
+CONTEXT_FIELDS = ('guild', 'track', 'interaction', 'user')
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # the default prepare() formats the message in the caller's thread;
+        # leave that to the listener thread
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    """`[subsystem] message`, the format the bot always printed."""
+
+    def format(self, record):
+        sub = record.name.split('.', 1)[1] if record.name.startswith(ROOT_LOGGER + '.') else record.name
+        text = f'[{sub}] {record.getMessage()}'
+        if record.exc_info:
+            text += '\n' + self.formatException(record.exc_info)
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the context fields as keys."""
+
+    def __init__(self, static: dict | None = None):
+        super().__init__()
+        # fields added to every line, e.g. the cluster id
+        self.static = {k: v for k, v in (static or {}).items() if v is not None}
+
+    def format(self, record):
+        data = {
+            **self.static,
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def setup_logging(cfg: LoggingSettings | None = None, static: dict | None = None):
+    """Configure the `bot` loggers from the [logging] settings section.
+
+    `static` fields are added to every JSON line.
+    """
+    global _listener
+    cfg = cfg or LoggingSettings()
+    if _listener is None:
+        atexit.register(stop_logging)
+    stop_logging()
+
+    handler = logging.StreamHandler(sys.stdout)
+    if cfg.format.lower() == 'json':
+        handler.setFormatter(JsonFormatter(static))
+    else:
+        handler.setFormatter(TextFormatter())
+    _listener = logging.handlers.QueueListener(queue.SimpleQueue(), handler, respect_handler_level=False)
+    _listener.start()
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.handlers[:] = [_QueueHandler(_listener.queue)]
+    root.propagate = False
+
+    # discord.py's own logs go through the same queue
+    discord_log = logging.getLogger('discord')
+    discord_log.handlers[:] = [_QueueHandler(_listener.queue)]
+    discord_log.propagate = False
+    set_levels(cfg)
+
+
+def set_levels(cfg: LoggingSettings, previous: LoggingSettings | None = None):
+    """Apply the configured levels (again, after a settings reload)."""
+    logging.getLogger(ROOT_LOGGER).setLevel(cfg.level.upper())
+    if previous is not None:
+        # subsystems no longer listed fall back to the global level
+        for sub in previous.levels.keys() - cfg.levels.keys():
+            logging.getLogger(f'{ROOT_LOGGER}.{sub}').setLevel(logging.NOTSET)
+    for sub, level in cfg.levels.items():
+        logging.getLogger(f'{ROOT_LOGGER}.{sub}').setLevel(level.upper())
+    logging.getLogger('discord').setLevel(cfg.discord_level.upper())
+
+
+def stop_logging():
+    """Flush and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,11 @@
+"""Starts the bot.
+
+Extraction workers are spawned processes, and spawning re-runs the main
+script in every worker. Keeping it this small means the workers only import
+services.engine. If bot.py were the main script, each worker would load the
+settings, open the caches and create a client of its own.
+"""
+
+if __name__ == '__main__':
+    import bot
+    bot.main()
@@ -0,0 +1,133 @@
+"""Minimal Prometheus metrics (text exposition format) served over HTTP."""
+import asyncio
+import bisect
+import logging
+import threading
+import time
+
+log = logging.getLogger('bot.metrics')
+
+# seconds; covers fast cache hits up to slow extractions / reconnects
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Cumulative histogram; `observe()` is safe to call from any thread."""
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def time(self):
+        """Context manager observing the duration of its block."""
+        return _Timer(self)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f'{self.name}_sum {total}')
+        lines.append(f'{self.name}_count {cumulative}')
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Gauge:
+    """Gauge whose value is computed by `fn` at scrape time."""
+
+    def __init__(self, name: str, help: str, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def render(self) -> list[str]:
+        try:
+            value = float(self.fn())
+        except Exception:
+            value = float('nan')
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge', f'{self.name} {value}']
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self._server: asyncio.AbstractServer | None = None
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, fn) -> Gauge:
+        metric = Gauge(name, help, fn)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    @property
+    def serving(self) -> bool:
+        return self._server is not None
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 9108):
+        """Serve GET /metrics; everything else is answered with 404."""
+        self._server = await asyncio.start_server(self._handle, host, port)
+        log.info('Serving on http://%s:%s/metrics', host, port)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            # skip the headers; the request has no body
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, ctype, body = '200 OK', 'text/plain; version=0.0.4; charset=utf-8', self.render().encode()
+            else:
+                status, ctype, body = '404 Not Found', 'text/plain', b'not found\n'
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\n'
+                         f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
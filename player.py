@@ -0,0 +1,224 @@
+"""Per-guild player state."""
+import asyncio
+import time
+from collections import deque
+
+from journal import track_record
+
+
+class Track:
+    """Compact queue record for one track.
+
+    Supports the small mapping subset (`get`, `[]`) the services use on track
+    dicts, so extraction results and queued tracks can be handled alike.
+    """
+    __slots__ = ('id', 'title', 'webpage_url', 'url', 'expire', 'duration', 'acodec', 'ext', 'abr')
+
+    def __init__(self, title=None, webpage_url=None, url=None, id=None, expire=None,
+                 duration=None, acodec=None, ext=None, abr=None):
+        self.id = id
+        self.title = title
+        self.webpage_url = webpage_url
+        self.url = url
+        self.expire = expire
+        self.duration = duration
+        self.acodec = acodec
+        self.ext = ext
+        self.abr = abr
+
+    @classmethod
+    def from_info(cls, info):
+        """Build a Track from an extraction result (dict) or return a Track as-is."""
+        if isinstance(info, Track):
+            return info
+        return cls(**{k: info.get(k) for k in cls.__slots__})
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __repr__(self):
+        return f'Track({self.title!r}, {self.webpage_url!r})'
+
+
+class GuildPlayer:
+    """All playback state of one guild.
+
+    The queue is a deque of Track records, so dequeuing and re-queuing the
+    current track (repeat) are O(1). `cleanup()` cancels every task the
+    player owns and drops its state; the bot removes the player from its
+    registry at the same time, so nothing is left behind per guild.
+    """
+    __slots__ = ('guild_id', 'queue', 'current', 'repeat', 'skip_votes', 'ui', 'timers', 'journal',
+                 'extractions',
+                 'task', 'wakeup', 'ended_at', 'last_gap', 'audio_path',
+                 'prewarm', 'prewarm_track', 'prewarm_timer', 'prewarm_task')
+
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        self.queue: deque[Track] = deque()
+        self.current: Track | None = None
+        self.repeat = False
+        self.skip_votes: set[int] = set()
+        # renderer of the single player message (renderer.PlayerMessage), set by the bot
+        self.ui = None
+        # shared deadline scheduler (scheduler.DeadlineScheduler) for the idle
+        # and pause-idle disconnects, set by the bot
+        self.timers = None
+        # queue journal (journal.QueueJournal) recording every queue change, set by the bot
+        self.journal = None
+        # running extractions on behalf of this guild
+        self.extractions: set[asyncio.Task] = set()
+        # playback loop task and the event that wakes it (track ended / enqueued)
+        self.task: asyncio.Task | None = None
+        self.wakeup = asyncio.Event()
+        # perf_counter() when the last track ended, and the last measured gap (s)
+        self.ended_at: float | None = None
+        self.last_gap: float | None = None
+        # how the current track is streamed: 'opus-copy', 'opus-encode', 'pcm' or 'opus-cache'
+        self.audio_path: str | None = None
+        # (source, audio path) pre-warmed for the next track (gapless mode)
+        self.prewarm = None
+        self.prewarm_track: Track | None = None
+        self.prewarm_timer: asyncio.TimerHandle | None = None
+        self.prewarm_task: asyncio.Task | None = None
+
+    def __len__(self):
+        return len(self.queue)
+
+    def _record(self, op, **fields):
+        if self.journal is not None:
+            self.journal.record(op, self.guild_id, **fields)
+
+    def enqueue(self, tracks) -> int:
+        """Append extraction results / tracks to the queue; returns how many were added."""
+        added = [Track.from_info(t) for t in tracks]
+        self.queue.extend(added)
+        if added:
+            self._record('add', t=[track_record(t) for t in added])
+        return len(added)
+
+    def dequeue(self) -> Track | None:
+        """Pop the next track and make it the current one."""
+        self.current = self.queue.popleft() if self.queue else None
+        self._record('pop')
+        return self.current
+
+    def push_front(self, track: Track):
+        """Put a track back at the head of the queue (retry / repeat)."""
+        self.queue.appendleft(track)
+        self._record('front', t=track_record(track))
+
+    def finish_current(self):
+        """Current track ended: re-queue it when repeat is on."""
+        track, self.current = self.current, None
+        if track is not None and self.repeat:
+            self.queue.appendleft(track)
+        self._record('end', repeat=self.repeat)
+
+    def drop_current(self):
+        """Forget the current track without re-queuing it (failed to play)."""
+        self.current = None
+        self._record('end', repeat=False)
+
+    def set_repeat(self, value: bool):
+        self.repeat = value
+        self._record('repeat', v=value)
+
+    def track_ended(self):
+        """Called on the event loop when the voice client finished a track."""
+        self.ended_at = time.perf_counter()
+        self.finish_current()
+        self.wakeup.set()
+
+    def mark_started(self):
+        """Record the silence between the previous track ending and this one starting.
+
+        Returns the gap, or None if no track ended before this one.
+        """
+        if self.ended_at is None:
+            return None
+        self.last_gap = time.perf_counter() - self.ended_at
+        self.ended_at = None
+        return self.last_gap
+
+    def next_track(self) -> Track | None:
+        """The track that will play after the current one."""
+        if self.repeat and self.current is not None:
+            return self.current
+        return self.queue[0] if self.queue else None
+
+    def take_prewarmed(self, track: Track):
+        """Return the pre-warmed (source, path) if it belongs to `track`, else discard it."""
+        source = self.prewarm if self.prewarm_track is track else None
+        if source is not None:
+            self.prewarm = None
+            self.prewarm_track = None
+        self.discard_prewarm()
+        return source
+
+    def discard_prewarm(self):
+        """Cancel a pending pre-warm and close any pre-warmed source."""
+        if self.prewarm_timer:
+            self.prewarm_timer.cancel()
+            self.prewarm_timer = None
+        self._cancel(self.prewarm_task)
+        self.prewarm_task = None
+        if self.prewarm is not None:
+            try:
+                self.prewarm[0].cleanup()
+            except Exception:
+                pass
+        self.prewarm = None
+        self.prewarm_track = None
+
+    def clear(self):
+        self.queue.clear()
+        self.current = None
+        self._record('clear')
+
+    @staticmethod
+    def _cancel(task):
+        # a task may tear down its own player; never cancel the running task
+        if task and not task.done() and task is not asyncio.current_task():
+            task.cancel()
+
+    def schedule_idle(self, delay: float, callback):
+        """Run `callback()` after `delay` s unless cancelled (queue ran empty)."""
+        self.timers.schedule((self.guild_id, 'idle'), delay, callback)
+
+    def schedule_pause_idle(self, delay: float, callback):
+        """Run `callback()` after `delay` s unless cancelled (playback paused)."""
+        self.timers.schedule((self.guild_id, 'pause'), delay, callback)
+
+    def cancel_idle(self):
+        if self.timers is not None:
+            self.timers.cancel((self.guild_id, 'idle'))
+
+    def cancel_pause_idle(self):
+        if self.timers is not None:
+            self.timers.cancel((self.guild_id, 'pause'))
+
+    def cleanup(self):
+        """Cancel the playback loop, timers and extractions and release all state."""
+        self._cancel(self.task)
+        self.task = None
+        self.discard_prewarm()
+        self.cancel_idle()
+        self.cancel_pause_idle()
+        for t in self.extractions:
+            self._cancel(t)
+        self.extractions.clear()
+        self.clear()
+        self.skip_votes.clear()
+        if self.ui is not None:
+            self.ui.close()
@@ -0,0 +1,119 @@
+"""Coalescing updater for the per-guild player message."""
+import asyncio
+import logging
+import time
+
+import discord
+
+log = logging.getLogger('bot.ui')
+
+
+class PlayerMessage:
+    """Owns the single player message of one guild.
+
+    Callers change the displayed state with `update()`; a background task
+    renders the latest state at most once per `min_interval` seconds, so a
+    burst of changes (skip votes, repeat toggles, track changes) becomes one
+    edit and superseded states are never sent. Edits are serialized, so while
+    discord.py waits out a rate-limit bucket further changes simply pile up
+    into the next edit. The message is only (re)sent when it does not exist.
+    """
+
+    def __init__(self, view_factory, min_interval: float = 1.0):
+        self.view_factory = view_factory
+        self.min_interval = min_interval
+        self.message: discord.Message | None = None
+        self.channel = None
+        # called with the message whenever a new one is sent
+        self.on_send = None
+        self.title = 'Now Playing'
+        self.body = ''
+        self.skip_line: str | None = None
+        self.footer: str | None = None
+        self._version = 0
+        self._rendered = 0
+        self._last_edit = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def update(self, *, channel=None, title=None, body=None, skip_line=..., footer=...):
+        """Change the displayed state and schedule a (coalesced) render.
+
+        `skip_line` and `footer` may be set to None to remove them.
+        """
+        if channel is not None and self.message is None:
+            # only matters while there is no message yet
+            self.channel = channel
+        if title is not None:
+            self.title = title
+        if body is not None:
+            self.body = body
+        if skip_line is not ...:
+            self.skip_line = skip_line
+        if footer is not ...:
+            self.footer = footer
+        self._version += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    def embed(self) -> discord.Embed:
+        desc = self.body
+        if self.skip_line:
+            desc = f'{desc}\n\n{self.skip_line}' if desc else self.skip_line
+        embed = discord.Embed(title=self.title, description=desc)
+        if self.footer:
+            embed.set_footer(text=self.footer)
+        return embed
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            wait = self._last_edit + self.min_interval - time.monotonic()
+            if wait > 0:
+                # let further changes collapse into this render
+                await asyncio.sleep(wait)
+                self._wakeup.clear()
+            if self._rendered == self._version:
+                continue
+            version = self._version
+            try:
+                await self._render()
+            except Exception as e:
+                # drop this state; the next change renders again
+                log.warning('Update failed: %s', e)
+            self._rendered = version
+            self._last_edit = time.monotonic()
+            if self._rendered != self._version:
+                self._wakeup.set()
+
+    async def _render(self):
+        embed = self.embed()
+        if self.message is not None:
+            try:
+                await self.message.edit(embed=embed, view=self.view_factory())
+                return
+            except discord.NotFound:
+                # deleted by someone: send a fresh one below
+                self.message = None
+        if self.channel is None:
+            return
+        self.message = await self.channel.send(embed=embed, view=self.view_factory())
+        if self.on_send is not None:
+            self.on_send(self.message)
+
+    def close(self):
+        """Stop the updater; the message itself is left alone."""
+        if self._task and not self._task.done() and self._task is not asyncio.current_task():
+            self._task.cancel()
+        self._task = None
+
+    async def delete(self):
+        self.close()
+        msg, self.message = self.message, None
+        if msg:
+            try:
+                await msg.delete()
+            except Exception:
+                pass
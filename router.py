@@ -0,0 +1,173 @@
+"""Command registry shared by slash commands and prefix (on_message) commands."""
+import abc
+import logging
+from typing import Optional
+
+import discord
+from discord import app_commands
+
+log = logging.getLogger('bot.commands')
+
+
+class Context(abc.ABC):
+    """What a command handler needs, independent of how it was invoked."""
+    is_slash = False
+
+    def __init__(self, guild, channel, author):
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+
+    @property
+    def voice_channel(self):
+        voice = getattr(self.author, 'voice', None)
+        return voice.channel if voice else None
+
+    @property
+    def log_context(self) -> dict:
+        """Fields for log records (`extra=`)."""
+        return {'guild': getattr(self.guild, 'id', None), 'user': getattr(self.author, 'id', None)}
+
+    def log_invocation(self, name: str, arg: str | None = None):
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('%s%s %s', '/' if self.is_slash else 'prefix ', name, arg or '', extra=self.log_context)
+
+    @abc.abstractmethod
+    async def send(self, content: str, *, ephemeral: bool = False):
+        """Reply to the invoking user."""
+
+    async def defer(self, *, ephemeral: bool = False):
+        """Acknowledge a command that takes a while (no-op for prefix commands)."""
+
+
+class SlashContext(Context):
+    is_slash = True
+
+    def __init__(self, interaction: discord.Interaction):
+        super().__init__(interaction.guild, interaction.channel, interaction.user)
+        self.interaction = interaction
+
+    @property
+    def log_context(self):
+        return {**super().log_context, 'interaction': self.interaction.id}
+
+    async def send(self, content, *, ephemeral=False):
+        # the first reply answers the interaction, later ones are followups
+        if self.interaction.response.is_done():
+            await self.interaction.followup.send(content, ephemeral=ephemeral)
+        else:
+            await self.interaction.response.send_message(content, ephemeral=ephemeral)
+
+    async def defer(self, *, ephemeral=False):
+        if not self.interaction.response.is_done():
+            await self.interaction.response.defer(ephemeral=ephemeral)
+
+
+class MessageContext(Context):
+    def __init__(self, message: discord.Message):
+        super().__init__(message.guild, message.channel, message.author)
+        self.message = message
+
+    async def send(self, content, *, ephemeral=False):
+        # channel messages cannot be ephemeral
+        await self.channel.send(content)
+
+
+class Command:
+    __slots__ = ('name', 'description', 'handler', 'param', 'required', 'param_description', 'slash')
+
+    def __init__(self, name, description, handler, param=None, required=False,
+                 param_description=None, slash=True):
+        self.name = name
+        self.description = description
+        self.handler = handler
+        self.param = param
+        self.required = required
+        self.param_description = param_description
+        self.slash = slash
+
+
+class CommandRegistry:
+    """Each command is defined once and exposed as a slash and a prefix command.
+
+    Handlers take a Context and, if the command has a parameter, its value
+    (for prefix commands: the rest of the message). The prefix index maps
+    every alias straight to its command, so routing a message is one dict
+    lookup no matter how many aliases are configured.
+    """
+
+    def __init__(self):
+        self.commands: dict[str, Command] = {}
+        self.index: dict[str, Command] = {}
+
+    def command(self, name, description, *, param=None, required=False, param_description=None, slash=True):
+        def decorator(handler):
+            self.commands[name] = Command(name, description, handler, param, required, param_description, slash)
+            return handler
+        return decorator
+
+    def build_index(self, aliases):
+        """Map each configured alias (lower case) to its command."""
+        self.index = self.make_index(aliases)
+        return self.index
+
+    def make_index(self, aliases) -> dict[str, Command]:
+        """The index for `aliases`, without installing it."""
+        index = {}
+        for name, names in aliases.items():
+            cmd = self.commands.get(name)
+            if cmd is None:
+                log.warning('Unknown command in [commands]: %s', name)
+                continue
+            for alias in names:
+                index.setdefault(alias.lower(), cmd)
+        return index
+
+    def install(self, tree: app_commands.CommandTree):
+        """Add all slash-enabled commands to the command tree."""
+        for cmd in self.commands.values():
+            if cmd.slash:
+                tree.add_command(self._slash_command(cmd))
+
+    @staticmethod
+    def _slash_command(cmd: Command) -> app_commands.Command:
+        handler = cmd.handler
+        if cmd.param is None:
+            async def callback(interaction: discord.Interaction):
+                ctx = SlashContext(interaction)
+                ctx.log_invocation(cmd.name)
+                await handler(ctx)
+        elif cmd.required:
+            async def callback(interaction: discord.Interaction, value: str):
+                ctx = SlashContext(interaction)
+                ctx.log_invocation(cmd.name, value)
+                await handler(ctx, value)
+        else:
+            async def callback(interaction: discord.Interaction, value: Optional[str] = None):
+                ctx = SlashContext(interaction)
+                ctx.log_invocation(cmd.name, value)
+                await handler(ctx, value)
+
+        command = app_commands.Command(name=cmd.name, description=cmd.description, callback=callback)
+        if cmd.param is not None:
+            command = app_commands.rename(value=cmd.param)(command)
+            if cmd.param_description:
+                command = app_commands.describe(value=cmd.param_description)(command)
+        return command
+
+    async def dispatch(self, message: discord.Message, prefix: str) -> bool:
+        """Route a prefix command; returns False if the message is not one."""
+        parts = message.content[len(prefix):].split(None, 1)
+        if not parts:
+            return False
+        cmd = self.index.get(parts[0].lower())
+        if cmd is None:
+            return False
+        rest = parts[1] if len(parts) > 1 else ''
+        ctx = MessageContext(message)
+        ctx.log_invocation(cmd.name, rest)
+        if cmd.param is None:
+            await cmd.handler(ctx)
+        else:
+            await cmd.handler(ctx, rest)
+        return True
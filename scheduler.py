@@ -0,0 +1,102 @@
+"""One heap-based scheduler for all per-guild deadlines (idle disconnects etc.)."""
+import asyncio
+import heapq
+import logging
+import math
+
+log = logging.getLogger('bot.idle')
+
+
+class DeadlineScheduler:
+    """Keyed deadlines on a single heap with a single loop timer.
+
+    `schedule(key, delay, callback)` sets (or moves) the deadline of `key`,
+    `cancel(key)` drops it; both are O(log n) / O(1) and create no tasks.
+    Deadlines are rounded up to `resolution` seconds, so timers that expire
+    close together fire as one batch: their callbacks (coroutine functions
+    without arguments) run concurrently in one task.
+    """
+
+    def __init__(self, resolution: float = 1.0):
+        self.resolution = resolution
+        self._entries: dict = {}      # key -> (deadline, seq, callback)
+        self._heap: list = []         # (deadline, seq, key); stale items are skipped
+        self._seq = 0
+        self._timer: asyncio.TimerHandle | None = None
+        self._timer_at: float | None = None
+        self._batches: set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def schedule(self, key, delay: float, callback):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max(0.0, delay)
+        if self.resolution > 0:
+            deadline = math.ceil(deadline / self.resolution) * self.resolution
+        self._seq += 1
+        self._entries[key] = (deadline, self._seq, callback)
+        heapq.heappush(self._heap, (deadline, self._seq, key))
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._compact()
+        self._arm(loop)
+
+    def cancel(self, key):
+        # the heap item goes stale and is skipped when it comes up
+        self._entries.pop(key, None)
+
+    def _compact(self):
+        self._heap = [(d, s, k) for k, (d, s, _) in self._entries.items()]
+        heapq.heapify(self._heap)
+
+    def _arm(self, loop):
+        while self._heap and self._is_stale(self._heap[0]):
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return
+        when = self._heap[0][0]
+        if self._timer is not None and self._timer_at <= when:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_at = when
+        self._timer = loop.call_at(when, self._fire)
+
+    def _is_stale(self, item) -> bool:
+        entry = self._entries.get(item[2])
+        return entry is None or entry[1] != item[1]
+
+    def _fire(self):
+        loop = asyncio.get_running_loop()
+        self._timer = None
+        self._timer_at = None
+        now = loop.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            item = heapq.heappop(self._heap)
+            if self._is_stale(item):
+                continue
+            due.append(self._entries.pop(item[2])[2])
+        if due:
+            task = loop.create_task(self._run_batch(due))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+        self._arm(loop)
+
+    @staticmethod
+    async def _run_batch(callbacks):
+        results = await asyncio.gather(*(cb() for cb in callbacks), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                log.error('Timer callback failed: %s', result)
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._entries.clear()
+        self._heap.clear()
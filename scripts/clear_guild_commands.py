@@ -1,7 +1,17 @@
-import tomllib
-import requests
+import argparse
+import asyncio
+import json
+import os
 import sys
 import time
+import tomllib
+
+import aiohttp
+
+API_BASE = "https://discord.com/api/v10"
+# where the bot stores the hash of the last synced command tree per scope
+SYNC_STATE = "cache/command_sync.json"
+
 
 def load_settings(path="settings.TOML"):
     try:
@@ -12,67 +22,180 @@ def load_settings(path="settings.TOML"):
         sys.exit(1)
 
 
-def main():
-    settings = load_settings()
-    bot_cfg = settings.get("bot", {})
-    token = bot_cfg.get("token")
-    app_id = bot_cfg.get("application_id")
-    guild_id = bot_cfg.get("test_guild_id")
+class DiscordClient:
+    """Minimal async REST client that honours Discord's rate limits.
 
-    if not token or not app_id or not guild_id:
-        print("Required values missing in settings.TOML: token, application_id, test_guild_id")
-        sys.exit(1)
+    Each route remembers the bucket Discord assigned to it; when a bucket has
+    no requests left, callers wait for its reset instead of provoking a 429.
+    429 responses (per-route or global) are retried after `retry_after`.
+    """
 
-    headers = {"Authorization": f"Bot {token}", "Content-Type": "application/json"}
-    base = f"https://discord.com/api/v10/applications/{app_id}/guilds/{guild_id}/commands"
+    def __init__(self, token, base=API_BASE, max_retries=5):
+        self.base = base.rstrip("/")
+        self.headers = {"Authorization": f"Bot {token}", "Content-Type": "application/json"}
+        self.max_retries = max_retries
+        self._session = None
+        self._route_bucket = {}   # "METHOD path" -> bucket id
+        self._buckets = {}        # bucket id -> (remaining, reset monotonic time)
+        self._locks = {}          # bucket id / route -> asyncio.Lock
+        self._global_reset = 0.0
 
+    async def __aenter__(self):
+        self._session = aiohttp.ClientSession(headers=self.headers)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+
+    async def request(self, method, path, json=None):
+        route = f"{method} {path}"
+        for attempt in range(self.max_retries + 1):
+            key = self._route_bucket.get(route, route)
+            lock = self._locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                await self._wait(key)
+                async with self._session.request(method, self.base + path, json=json) as r:
+                    self._update(route, r.headers)
+                    if r.status == 429:
+                        body = await r.json(content_type=None)
+                        retry = float(body.get("retry_after", 1.0))
+                        if body.get("global"):
+                            self._global_reset = time.monotonic() + retry
+                        print(f"Rate limited on {route}, retrying in {retry:.2f}s...")
+                        await asyncio.sleep(retry)
+                        continue
+                    if r.status >= 400:
+                        raise RuntimeError(f"{route} failed: {r.status} {await r.text()}")
+                    if r.status == 204:
+                        return None
+                    return await r.json(content_type=None)
+        raise RuntimeError(f"{route} failed: too many retries")
+
+    async def _wait(self, key):
+        now = time.monotonic()
+        if self._global_reset > now:
+            await asyncio.sleep(self._global_reset - now)
+        remaining, reset = self._buckets.get(key, (1, 0.0))
+        if remaining <= 0 and reset > time.monotonic():
+            await asyncio.sleep(reset - time.monotonic())
+
+    def _update(self, route, headers):
+        bucket = headers.get("X-RateLimit-Bucket")
+        if not bucket:
+            return
+        self._route_bucket[route] = bucket
+        try:
+            remaining = int(headers.get("X-RateLimit-Remaining", 1))
+            reset_after = float(headers.get("X-RateLimit-Reset-After", 0))
+        except ValueError:
+            return
+        self._buckets[bucket] = (remaining, time.monotonic() + reset_after)
+
+
+def forget_synced(path, app_id, guild_ids):
+    """Drop the bot's sync hashes of the cleared scopes, so its next start syncs them again."""
     try:
-        r = requests.get(base, headers=headers)
-        r.raise_for_status()
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return
     except Exception as e:
-        print("Failed to list commands:", e)
-        sys.exit(1)
+        print(f"Could not read {path}: {e}; restart the bot with FORCE_COMMAND_SYNC=1")
+        return
+    keys = [f"{app_id}:global" if g is None else f"{app_id}:guild:{g}" for g in guild_ids]
+    removed = [k for k in keys if state.pop(k, None) is not None]
+    if not removed:
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+    print(f"Reset sync state for {', '.join(removed)}; the bot re-syncs on its next start")
+
+
+def scope_path(app_id, guild_id):
+    if guild_id is None:
+        return f"/applications/{app_id}/commands"
+    return f"/applications/{app_id}/guilds/{guild_id}/commands"
 
-    commands = r.json()
-    print(f"Found {len(commands)} command(s) in guild {guild_id}")
 
-    session = requests.Session()
+async def clear_scope(client, app_id, guild_id, mode, dry_run):
+    """Remove all commands of one scope (a guild, or global when guild_id is None)."""
+    name = "global" if guild_id is None else f"guild {guild_id}"
+    path = scope_path(app_id, guild_id)
+    try:
+        commands = await client.request("GET", path) or []
+    except Exception as e:
+        print(f"[{name}] Failed to list commands:", e)
+        return False
+
+    print(f"[{name}] Found {len(commands)} command(s)")
     for cmd in commands:
-        cid = cmd.get("id")
-        if not cid:
-            continue
-        url = f"{base}/{cid}"
-        retries = 0
-        while True:
-            try:
-                d = session.delete(url, headers=headers)
-            except Exception as e:
-                print("Error deleting", cid, e)
-                break
-
-            if d.status_code in (200, 204):
-                print("Deleted", cid)
-                break
-            if d.status_code == 429:
-                # Respect Discord's retry_after
-                try:
-                    body = d.json()
-                    retry = float(body.get("retry_after", 1.0))
-                except Exception:
-                    retry = 1.0
-                wait = retry + 0.5
-                print(f"Rate limited on {cid}, sleeping {wait:.2f}s and retrying...")
-                time.sleep(wait)
-                retries += 1
-                if retries > 5:
-                    print("Too many retries for", cid)
-                    break
-                continue
-            else:
-                print("Failed to delete", cid, d.status_code, d.text)
-                break
+        print(f"[{name}]   - {cmd.get('name')} ({cmd.get('id')})")
+    if not commands:
+        return True
+    if dry_run:
+        print(f"[{name}] Dry run: would remove {len(commands)} command(s)")
+        return True
+
+    try:
+        if mode == "bulk":
+            # bulk overwrite with an empty list removes everything in one call
+            await client.request("PUT", path, json=[])
+            print(f"[{name}] Removed {len(commands)} command(s)")
+        else:
+            for cmd in commands:
+                if cmd.get("id"):
+                    await client.request("DELETE", f"{path}/{cmd['id']}")
+                    print(f"[{name}] Deleted", cmd["id"])
+    except Exception as e:
+        print(f"[{name}] Failed:", e)
+        return False
+    return True
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Remove slash commands from guilds and/or the global scope.")
+    p.add_argument("--guild", action="append", default=[], metavar="ID",
+                   help="guild to clear (repeatable); defaults to test_guild_id from settings")
+    p.add_argument("--global", dest="global_scope", action="store_true", help="also clear global commands")
+    p.add_argument("--mode", choices=("bulk", "delete"), default="bulk",
+                   help="bulk: one overwrite call per scope (default); delete: one call per command")
+    p.add_argument("--dry-run", action="store_true", help="only list what would be removed")
+    p.add_argument("--settings", default="settings.TOML", help="settings file (default: settings.TOML)")
+    p.add_argument("--api-base", default=API_BASE, help="API base URL (e.g. a local mock server)")
+    p.add_argument("--sync-state", default=SYNC_STATE,
+                   help=f"the bot's command sync state (default: {SYNC_STATE})")
+    return p.parse_args()
 
+
+async def run(args):
+    settings = load_settings(args.settings)
+    bot_cfg = settings.get("bot", {})
+    token = bot_cfg.get("token")
+    app_id = bot_cfg.get("application_id")
+
+    guild_ids = args.guild or ([bot_cfg["test_guild_id"]] if bot_cfg.get("test_guild_id") else [])
+    scopes = [str(g) for g in guild_ids]
+    if args.global_scope:
+        scopes.append(None)
+
+    if not token or not app_id or not scopes:
+        print("Required values missing: token, application_id and a guild (test_guild_id / --guild) or --global")
+        return 1
+
+    async with DiscordClient(token, base=args.api_base) as client:
+        results = await asyncio.gather(*(clear_scope(client, app_id, g, args.mode, args.dry_run) for g in scopes))
+
+    if not args.dry_run:
+        # the bot skips syncing scopes whose command tree hash is unchanged
+        forget_synced(args.sync_state, app_id, [g for g, ok in zip(scopes, results) if ok])
     print("Done.")
+    return 0 if all(results) else 1
+
+
+def main():
+    sys.exit(asyncio.run(run(parse_args())))
 
 
 if __name__ == "__main__":
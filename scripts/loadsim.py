@@ -0,0 +1,490 @@
+"""Offline load simulator: drives the bot's real handlers against fakes.
+
+    python3 scripts/loadsim.py --guilds 200 --extract-latency 0.05 --json baseline.json
+
+Every simulated guild runs the same scenario through the real code paths
+(slash /play and /playlist callbacks, prefix commands via on_message, the
+player buttons and the playback loop). Discord, voice and YouTube are
+replaced by fakes with configurable latency, and FFmpeg is never started,
+so runs are repeatable without network access. The report lists throughput,
+event loop lag and latency percentiles per operation; `--json` stores it
+for comparing two runs.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETTINGS = '''
+[bot]
+token = ""
+prefix = "!"
+idle_timeout = 120
+pause_idle_timeout = 300
+skip_required = 1
+prefetch_ahead = 2
+prewarm_seconds = 0
+message_update_interval = {message_interval}
+
+[cache]
+enabled = false
+
+[extraction]
+workers = 0
+timeout = 30
+
+[metrics]
+enabled = false
+
+[logging]
+level = "{log_level}"
+
+[commands]
+play = ["play", "p"]
+playlist = ["playlist", "pl"]
+skip = ["skip"]
+queue = ["queue"]
+pause = ["pause"]
+resume = ["resume"]
+'''
+
+
+# --- fakes ---
+
+class StubEngine:
+    """Stands in for ExtractionEngine: answers after a configurable delay."""
+
+    def __init__(self, latency: float, jitter: float, playlist_size: int, track_seconds: float):
+        self.latency = latency
+        self.jitter = jitter
+        self.playlist_size = playlist_size
+        self.track_seconds = track_seconds
+        self.pending = 0
+        self.calls = 0
+
+    async def run(self, target, flat=False, timeout=None):
+        self.pending += 1
+        self.calls += 1
+        try:
+            await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        finally:
+            self.pending -= 1
+        if flat:
+            base = abs(hash(target)) % 10 ** 6
+            return [{'title': f'Playlist track {i}', 'webpage_url': f'https://www.youtube.com/watch?v=s{base:06d}{i:04d}'}
+                    for i in range(self.playlist_size)]
+        vid = f'{abs(hash(target)) % 10 ** 11:011d}'
+        return {
+            'id': vid,
+            'title': f'Track {target[:40]}',
+            'url': f'https://stub.invalid/{vid}?expire={int(time.time()) + 6 * 3600}',
+            'webpage_url': f'https://www.youtube.com/watch?v={vid}',
+            'duration': self.track_seconds,
+            'acodec': 'opus',
+            'ext': 'webm',
+            'abr': 128,
+        }
+
+    def shutdown(self):
+        pass
+
+
+class FakeSource:
+    def read(self):
+        return b'\0' * 3840
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        pass
+
+
+class FakeVoiceClient:
+    """Plays each source for `track_seconds` and then calls `after` like discord.py."""
+
+    def __init__(self, sim, guild, channel):
+        self.sim = sim
+        self.guild = guild
+        self.channel = channel
+        self._connected = True
+        self._handle = None
+        self._after = None
+        self._source = None
+        self._remaining = None
+        self._ends_at = 0.0
+
+    def is_connected(self):
+        return self._connected
+
+    def is_playing(self):
+        return self._handle is not None
+
+    def is_paused(self):
+        return self._remaining is not None
+
+    def play(self, source, *, after=None):
+        if self._handle is not None or self._remaining is not None:
+            raise RuntimeError('Already playing audio.')
+        self.sim.track_started(self.guild.id)
+        source.read()
+        self._source = source
+        self._after = after
+        self._schedule(self.sim.args.track_seconds)
+
+    def _schedule(self, delay):
+        loop = asyncio.get_running_loop()
+        self._ends_at = loop.time() + delay
+        self._handle = loop.call_later(delay, self._finish)
+
+    def _finish(self):
+        self._handle = None
+        self._remaining = None
+        source, self._source = self._source, None
+        after, self._after = self._after, None
+        if source:
+            source.cleanup()
+        self.sim.track_ended(self.guild.id)
+        if after:
+            after(None)
+
+    def pause(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+            self._remaining = max(0.0, self._ends_at - asyncio.get_running_loop().time())
+
+    def resume(self):
+        if self._remaining is not None:
+            remaining, self._remaining = self._remaining, None
+            self._schedule(remaining)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+        if self._handle is not None or self._remaining is not None:
+            self._finish()
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self._connected = False
+        self.guild.voice_client = None
+
+
+class FakeMessage:
+    def __init__(self, sim, channel):
+        self.sim = sim
+        self.channel = channel
+        self.id = id(self)
+
+    async def edit(self, **kwargs):
+        await self.sim.rest('message.edit')
+
+    async def delete(self):
+        await self.sim.rest('message.delete')
+
+
+class FakeTextChannel:
+    def __init__(self, sim, guild):
+        self.sim = sim
+        self.guild = guild
+        self.id = guild.id * 10 + 1
+
+    async def send(self, content=None, **kwargs):
+        await self.sim.rest('channel.send')
+        return FakeMessage(self.sim, self)
+
+
+class FakeVoiceChannel:
+    def __init__(self, sim, guild):
+        self.sim = sim
+        self.guild = guild
+        self.id = guild.id * 10 + 2
+        self.members = []
+
+    async def connect(self, **kwargs):
+        await asyncio.sleep(self.sim.args.connect_latency)
+        self.guild.voice_client = FakeVoiceClient(self.sim, self.guild, self)
+        return self.guild.voice_client
+
+    def __str__(self):
+        return f'voice-{self.guild.id}'
+
+
+class FakeGuild:
+    def __init__(self, sim, guild_id):
+        self.id = guild_id
+        self.voice_client = None
+        self.text_channels = [FakeTextChannel(sim, self)]
+        self.voice_channel = FakeVoiceChannel(sim, self)
+
+
+class FakeMember:
+    def __init__(self, member_id, guild):
+        self.id = member_id
+        self.display_name = f'user{member_id}'
+        self.bot = False
+        self.voice = type('VoiceState', (), {'channel': guild.voice_channel})()
+        guild.voice_channel.members.append(self)
+
+
+class FakeResponse:
+    def __init__(self, sim):
+        self.sim = sim
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def send_message(self, content=None, **kwargs):
+        self._done = True
+        await self.sim.rest('interaction.respond')
+
+    async def defer(self, **kwargs):
+        self._done = True
+        await self.sim.rest('interaction.defer')
+
+
+class FakeFollowup:
+    def __init__(self, sim):
+        self.sim = sim
+
+    async def send(self, content=None, **kwargs):
+        await self.sim.rest('interaction.followup')
+
+
+class FakeInteraction:
+    _ids = 0
+
+    def __init__(self, sim, guild, user):
+        FakeInteraction._ids += 1
+        self.id = FakeInteraction._ids
+        self.guild = guild
+        self.user = user
+        self.channel = guild.text_channels[0]
+        self.response = FakeResponse(sim)
+        self.followup = FakeFollowup(sim)
+
+
+class FakeMessageEvent:
+    def __init__(self, guild, author, content):
+        self.guild = guild
+        self.author = author
+        self.channel = guild.text_channels[0]
+        self.content = content
+
+
+# --- simulation ---
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    i = min(len(values) - 1, max(0, round(q * (len(values) - 1))))
+    return values[i]
+
+
+class Simulation:
+    def __init__(self, args, bot, engine):
+        self.args = args
+        self.bot = bot
+        self.engine = engine
+        self.latencies = defaultdict(list)
+        self.gaps = []
+        self.lag = []
+        self._ended = {}
+        self.tracks_played = 0
+        self.errors = 0
+
+    async def rest(self, name):
+        start = time.perf_counter()
+        await asyncio.sleep(self.args.rest_latency)
+        self.latencies['rest:' + name].append(time.perf_counter() - start)
+
+    def track_started(self, gid):
+        self.tracks_played += 1
+        ended = self._ended.pop(gid, None)
+        if ended is not None:
+            self.gaps.append(time.perf_counter() - ended)
+
+    def track_ended(self, gid):
+        self._ended[gid] = time.perf_counter()
+
+    async def op(self, name, coro):
+        start = time.perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            self.errors += 1
+            print(f'[loadsim] {name} failed: {e!r}')
+        self.latencies[name].append(time.perf_counter() - start)
+
+    async def wait_playing(self, guild, timeout=30.0):
+        """Time from now until the guild's voice client is playing."""
+        start = time.perf_counter()
+        while time.perf_counter() - start < timeout:
+            vc = guild.voice_client
+            if vc and vc.is_playing():
+                self.latencies['time_to_play'].append(time.perf_counter() - start)
+                return True
+            await asyncio.sleep(0.005)
+        self.errors += 1
+        return False
+
+    async def monitor_loop_lag(self, interval=0.01):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.lag.append(loop.time() - start - interval)
+
+    async def guild_scenario(self, gid):
+        bot = self.bot
+        guild = FakeGuild(self, gid)
+        user = FakeMember(gid * 10 + 1, guild)
+        play = bot.tree.get_command('play')
+        playlist = bot.tree.get_command('playlist')
+
+        def interaction():
+            return FakeInteraction(self, guild, user)
+
+        await asyncio.sleep(random.uniform(0, self.args.ramp))
+        await self.op('slash:play', play.callback(interaction(), f'song {gid}'))
+        await self.wait_playing(guild)
+        await self.op('prefix:play', bot.on_message(FakeMessageEvent(guild, user, f'!p another song {gid}')))
+        await self.op('slash:playlist', playlist.callback(interaction(), f'https://www.youtube.com/playlist?list=PL{gid}'))
+        await self.op('prefix:queue', bot.on_message(FakeMessageEvent(guild, user, '!queue')))
+        # ordinary chat goes through the early reject
+        for _ in range(self.args.chatter):
+            await self.op('on_message:chatter', bot.on_message(FakeMessageEvent(guild, user, 'just chatting here')))
+
+        view = bot.PlayerView()
+        await self.op('button:repeat', view.repeat_toggle.callback(interaction()))
+        await self.op('button:repeat', view.repeat_toggle.callback(interaction()))
+        await self.op('button:queue', view.show_queue.callback(interaction()))
+        await self.op('button:play_pause', view.play_pause.callback(interaction()))
+        await self.op('button:play_pause', view.play_pause.callback(interaction()))
+        for _ in range(self.args.skips):
+            player = bot.players.get(gid)
+            if player:
+                player.skip_votes.clear()
+            await self.op('button:skip', view.skip.callback(interaction()))
+            await self.wait_playing(guild)
+        await self.op('play_next_for_guild', bot.play_next_for_guild(guild))
+
+        # let a few tracks advance by themselves
+        await asyncio.sleep(self.args.track_seconds * self.args.auto_tracks)
+        await self.op('button:stop', view.stop.callback(interaction()))
+
+    async def run(self):
+        monitor = asyncio.create_task(self.monitor_loop_lag())
+        start = time.perf_counter()
+        await asyncio.gather(*(self.guild_scenario(gid) for gid in range(1, self.args.guilds + 1)))
+        elapsed = time.perf_counter() - start
+        monitor.cancel()
+        for gid in list(self.bot.players):
+            self.bot.release_player(gid)
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        ops = {k: v for k, v in self.latencies.items() if not k.startswith('rest:')}
+        total_ops = sum(len(v) for v in ops.values())
+
+        def stats(values):
+            return {
+                'count': len(values),
+                'p50_ms': percentile(values, 0.50) * 1000,
+                'p95_ms': percentile(values, 0.95) * 1000,
+                'p99_ms': percentile(values, 0.99) * 1000,
+                'max_ms': max(values, default=0.0) * 1000,
+            }
+
+        return {
+            'config': vars(self.args),
+            'elapsed_s': elapsed,
+            'operations': total_ops,
+            'ops_per_s': total_ops / elapsed if elapsed else 0.0,
+            'tracks_played': self.tracks_played,
+            'extractions': self.engine.calls,
+            'errors': self.errors,
+            'loop_lag': stats(self.lag),
+            'track_gap': stats(self.gaps),
+            'latency': {k: stats(v) for k, v in sorted(self.latencies.items())},
+        }
+
+
+def print_report(r):
+    print(f"\n{r['config']['guilds']} guilds in {r['elapsed_s']:.2f}s: {r['operations']} operations "
+          f"({r['ops_per_s']:.0f}/s), {r['tracks_played']} tracks, {r['extractions']} extractions, {r['errors']} errors")
+    header = f"{'':32} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    print(header)
+    rows = [('loop lag', r['loop_lag']), ('track gap', r['track_gap'])] + list(r['latency'].items())
+    for name, s in rows:
+        print(f"{name:32} {s['count']:>7} {s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f} {s['max_ms']:>9.2f}")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Simulate many guilds against the real handlers, offline.')
+    p.add_argument('--guilds', type=int, default=200)
+    p.add_argument('--extract-latency', type=float, default=0.05, help='seconds per stub extraction')
+    p.add_argument('--extract-jitter', type=float, default=0.02)
+    p.add_argument('--connect-latency', type=float, default=0.05, help='seconds per voice connect')
+    p.add_argument('--rest-latency', type=float, default=0.01, help='seconds per Discord REST call')
+    p.add_argument('--track-seconds', type=float, default=0.3, help='simulated track length')
+    p.add_argument('--playlist-size', type=int, default=50)
+    p.add_argument('--skips', type=int, default=3)
+    p.add_argument('--auto-tracks', type=int, default=3, help='tracks left to end by themselves')
+    p.add_argument('--chatter', type=int, default=20, help='non-command messages per guild')
+    p.add_argument('--ramp', type=float, default=1.0, help='spread guild start over this many seconds')
+    p.add_argument('--message-interval', type=float, default=1.0, help='player message update interval')
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--json', help='write the report to this file')
+    p.add_argument('--verbose', action='store_true', help="show the bot's own log output")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    # the bot reads settings.TOML from the working directory at import time
+    workdir = tempfile.mkdtemp(prefix='loadsim-')
+    with open(os.path.join(workdir, 'settings.TOML'), 'w', encoding='utf-8') as f:
+        f.write(SETTINGS.format(message_interval=args.message_interval,
+                                log_level='INFO' if args.verbose else 'WARNING'))
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+
+    import bot
+    from services.youtube import set_extraction_engine
+
+    engine = StubEngine(args.extract_latency, args.extract_jitter, args.playlist_size, args.track_seconds)
+    set_extraction_engine(engine)
+
+    async def open_source(track, url):
+        return FakeSource(), 'opus-copy'
+
+    # never spawn FFmpeg
+    bot._open_source = open_source
+
+    async def run():
+        return await Simulation(args, bot, engine).run()
+
+    report = asyncio.run(run())
+    print_report(report)
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f'Report written to {json_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+"""Persistent caches: extracted track metadata and frequently played audio."""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger('bot.cache')
+
+
+class TrackCache:
+    """On-disk cache of track metadata keyed by video ID and normalized query.
+
+    Metadata (title, webpage_url, format info) is kept for `ttl` seconds.
+    The stream URL is stored alongside it but is only handed out while its
+    own `expire` timestamp is still in the future; callers re-resolve it
+    otherwise. The table is trimmed to `max_entries` rows, least recently
+    used first. Loudness measurements (services.loudness) are kept per video
+    ID as long as its track is.
+
+    All methods block on SQLite; call them from a thread (`asyncio.to_thread`)
+    when on the event loop.
+    """
+
+    def __init__(self, path: str = 'cache/tracks.sqlite3', ttl: int = 7 * 24 * 3600, max_entries: int = 50000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stream_hits = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS tracks ('
+            ' video_id TEXT PRIMARY KEY, meta TEXT NOT NULL, url TEXT, expire REAL,'
+            ' fetched_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS queries ('
+            ' query TEXT PRIMARY KEY, video_id TEXT NOT NULL, created_at REAL NOT NULL)'
+        )
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS loudness ('
+            ' video_id TEXT PRIMARY KEY, integrated REAL NOT NULL, peak REAL NOT NULL, measured_at REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS tracks_accessed ON tracks(accessed_at)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS queries_video ON queries(video_id)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS queries_created ON queries(created_at)')
+
+    def get(self, query_key: str | None = None, video_id: str | None = None) -> dict | None:
+        """Return the cached track for a query key or video ID, or None.
+
+        The returned dict only contains `url`/`expire` if the stream URL has
+        not expired yet.
+        """
+        now = time.time()
+        with self._lock:
+            if not video_id and query_key:
+                row = self._db.execute(
+                    'SELECT video_id, created_at FROM queries WHERE query = ?', (query_key,)
+                ).fetchone()
+                if row and now - row[1] < self.ttl:
+                    video_id = row[0]
+            row = None
+            if video_id:
+                row = self._db.execute(
+                    'SELECT meta, url, expire, fetched_at FROM tracks WHERE video_id = ?', (video_id,)
+                ).fetchone()
+            if not row or now - row[3] >= self.ttl:
+                self.misses += 1
+                return None
+            self._db.execute('UPDATE tracks SET accessed_at = ? WHERE video_id = ?', (now, video_id))
+            self.hits += 1
+            track = json.loads(row[0])
+            if row[1] and row[2] and row[2] > now:
+                track['url'] = row[1]
+                track['expire'] = row[2]
+                self.stream_hits += 1
+            return track
+
+    def put(self, track: dict, query_key: str | None = None):
+        """Store `track` (needs an `id`) and optionally map `query_key` to it."""
+        video_id = track.get('id')
+        if not video_id:
+            return
+        now = time.time()
+        meta = {k: v for k, v in track.items() if k not in ('url', 'expire')}
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO tracks (video_id, meta, url, expire, fetched_at, accessed_at)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (video_id, json.dumps(meta), track.get('url'), track.get('expire'), now, now),
+            )
+            if query_key:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO queries (query, video_id, created_at) VALUES (?, ?, ?)',
+                    (query_key, video_id, now),
+                )
+            self._writes += 1
+            # counting rows is not free, so only trim every so often
+            if self._writes % 100 == 0:
+                self._evict()
+
+    def _evict(self, batch: int = 1000):
+        # every delete walks an index and removes at most `batch` rows
+        count = self._db.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+        excess = min(count - self.max_entries, batch)
+        self._db.execute('BEGIN')
+        try:
+            if excess > 0:
+                victims = [(r[0],) for r in self._db.execute(
+                    'SELECT video_id FROM tracks ORDER BY accessed_at LIMIT ?', (excess,)
+                )]
+                self._db.executemany('DELETE FROM tracks WHERE video_id = ?', victims)
+                self._db.executemany('DELETE FROM queries WHERE video_id = ?', victims)
+                self._db.executemany('DELETE FROM loudness WHERE video_id = ?', victims)
+            self._db.execute(
+                'DELETE FROM queries WHERE rowid IN'
+                ' (SELECT rowid FROM queries WHERE created_at < ? ORDER BY created_at LIMIT ?)',
+                (time.time() - self.ttl, batch),
+            )
+            self._db.execute('COMMIT')
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+
+    def loudness(self, video_id: str) -> tuple[float, float] | None:
+        """Stored (integrated LUFS, true peak dBTP) of `video_id`, or None."""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT integrated, peak FROM loudness WHERE video_id = ?', (video_id,)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def put_loudness(self, video_id: str, integrated: float, peak: float):
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO loudness (video_id, integrated, peak, measured_at) VALUES (?, ?, ?, ?)',
+                (video_id, integrated, peak, time.time()),
+            )
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'stream_hits': self.stream_hits}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _part_owner(name: str) -> int | None:
+    """PID that wrote a `<video-id>.opus.<pid>.part` file, if known."""
+    parts = name.rsplit('.', 2)
+    return int(parts[1]) if len(parts) == 3 and parts[1].isdigit() else None
+
+
+def _pid_alive(pid: int | None) -> bool:
+    if pid is None or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class AudioCache:
+    """Local Ogg/Opus copies of frequently played tracks, keyed by video ID.
+
+    Every play is counted; once a track has been played `min_plays` times it
+    is downloaded in the background with FFmpeg (codec copy for Opus
+    streams). Stored files are evicted least recently played first whenever
+    their total size exceeds `max_bytes`. Playing a cached file needs no
+    extraction and no remote connection.
+
+    `lookup()` and `record_play()` block on SQLite; call them from a thread
+    (`asyncio.to_thread`) when on the event loop. `store()` does so itself.
+    """
+
+    def __init__(self, path: str = 'cache/audio', max_bytes: int = 2 * 1024 ** 3, min_plays: int = 3,
+                 downloads: int = 1, ffmpeg: str = 'ffmpeg'):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        self.ffmpeg = ffmpeg
+        self.hits = 0
+        self._downloads = asyncio.Semaphore(max(1, downloads))
+        self._pending: set[str] = set()
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(path, 'index.sqlite3'), check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS audio ('
+            ' video_id TEXT PRIMARY KEY, plays INTEGER NOT NULL, size INTEGER,'
+            ' accessed_at REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS audio_accessed ON audio(accessed_at)')
+        self._reconcile()
+
+    def _file(self, video_id: str) -> str:
+        return os.path.join(self.path, f'{video_id}.opus')
+
+    def _reconcile(self):
+        # drop partial downloads left by dead processes (another live process,
+        # e.g. a second cluster, may still be writing its own) and index rows
+        # whose file is gone
+        for name in os.listdir(self.path):
+            if name.endswith('.part') and not _pid_alive(_part_owner(name)):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+        with self._lock:
+            rows = self._db.execute('SELECT video_id FROM audio WHERE size IS NOT NULL').fetchall()
+            for (video_id,) in rows:
+                if not os.path.exists(self._file(video_id)):
+                    self._db.execute('UPDATE audio SET size = NULL WHERE video_id = ?', (video_id,))
+
+    def lookup(self, video_id: str | None) -> str | None:
+        """Path of the cached file for `video_id`, or None."""
+        if not video_id:
+            return None
+        with self._lock:
+            row = self._db.execute('SELECT size FROM audio WHERE video_id = ?', (video_id,)).fetchone()
+        if not row or row[0] is None:
+            return None
+        path = self._file(video_id)
+        if not os.path.exists(path):
+            return None
+        self.hits += 1
+        return path
+
+    def record_play(self, video_id: str | None) -> bool:
+        """Count a play; returns True if the track should be downloaded now."""
+        if not video_id:
+            return False
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO audio (video_id, plays, accessed_at) VALUES (?, 1, ?)'
+                ' ON CONFLICT(video_id) DO UPDATE SET plays = plays + 1, accessed_at = excluded.accessed_at',
+                (video_id, time.time()),
+            )
+            plays, size = self._db.execute(
+                'SELECT plays, size FROM audio WHERE video_id = ?', (video_id,)
+            ).fetchone()
+        return size is None and plays >= self.min_plays and video_id not in self._pending
+
+    async def store(self, video_id: str, url: str, opus: bool):
+        """Download `url` into the cache (runs FFmpeg; meant as a background task)."""
+        if video_id in self._pending:
+            return
+        self._pending.add(video_id)
+        target = self._file(video_id)
+        # per-process name: <video-id>.opus.<pid>.part
+        part = f'{target}.{os.getpid()}.part'
+        try:
+            async with self._downloads:
+                codec = ['-c:a', 'copy'] if opus else ['-c:a', 'libopus', '-b:a', '128k']
+                proc = await asyncio.create_subprocess_exec(
+                    self.ffmpeg, '-nostdin', '-loglevel', 'error', '-y',
+                    '-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5',
+                    '-i', url, '-vn', '-map', '0:a:0', *codec, '-f', 'opus', part,
+                    stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+                )
+                try:
+                    _, err = await proc.communicate()
+                except asyncio.CancelledError:
+                    proc.kill()
+                    await proc.wait()
+                    raise
+                if proc.returncode != 0:
+                    raise RuntimeError(err.decode(errors='replace').strip()[-300:] or f'exit {proc.returncode}')
+            size = await asyncio.to_thread(self._commit, video_id, part, target)
+            log.info('Stored audio for %s (%d KiB)', video_id, size // 1024, extra={'track': video_id})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning('Audio download failed for %s: %s', video_id, e, extra={'track': video_id})
+        finally:
+            self._pending.discard(video_id)
+            if os.path.exists(part):
+                os.remove(part)
+
+    def _commit(self, video_id: str, part: str, target: str) -> int:
+        # runs in a thread: publish the download, then make room for it
+        os.replace(part, target)
+        size = os.path.getsize(target)
+        with self._lock:
+            self._db.execute('UPDATE audio SET size = ? WHERE video_id = ?', (size, video_id))
+        self._evict()
+        return size
+
+    def _evict(self):
+        with self._lock:
+            total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM audio').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = self._db.execute(
+                'SELECT video_id, size FROM audio WHERE size IS NOT NULL ORDER BY accessed_at'
+            ).fetchall()
+            for video_id, size in rows:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(self._file(video_id))
+                except FileNotFoundError:
+                    pass
+                # keep the play count, so a track that stays popular comes back
+                self._db.execute('UPDATE audio SET size = NULL WHERE video_id = ?', (video_id,))
+                total -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, total = self._db.execute(
+                'SELECT COUNT(size), COALESCE(SUM(size), 0) FROM audio'
+            ).fetchone()
+        return {'files': count, 'bytes': total, 'hits': self.hits}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
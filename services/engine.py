@@ -0,0 +1,339 @@
+"""Extraction engine: runs yt-dlp in dedicated worker processes (or threads)."""
+import asyncio
+import logging
+import multiprocessing
+import random
+import threading
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+
+import yt_dlp
+
+log = logging.getLogger('bot.extract')
+
+YTDL_OPTS = {
+    'format': 'bestaudio/best',
+    'noplaylist': True,
+    'quiet': True,
+    'no_warnings': True,
+    # fail stuck network reads inside yt-dlp instead of hanging a worker forever
+    'socket_timeout': 15,
+}
+
+# flat listing only returns ids/titles of playlist entries, no per-video extraction
+YTDL_FLAT_OPTS = {
+    **YTDL_OPTS,
+    'noplaylist': False,
+    'extract_flat': 'in_playlist',
+}
+
+
+class ExtractionError(Exception):
+    """An extraction failed inside a worker (message of the original error)."""
+
+
+class ExtractionTimeout(ExtractionError):
+    """An extraction did not finish before its deadline."""
+
+
+class ExtractionUnavailable(ExtractionError):
+    """The circuit breaker is open: upstream has been failing consistently."""
+
+
+# errors that describe the requested video itself; retrying will not help and
+# they do not indicate that upstream is unhealthy
+_PERMANENT_ERRORS = (
+    'video unavailable', 'private video', 'not available', 'has been removed',
+    'copyright', 'sign in to confirm your age', 'unsupported url', 'members-only',
+    'no video results',
+)
+
+
+def is_permanent_error(error: Exception) -> bool:
+    msg = str(error).lower()
+    return any(p in msg for p in _PERMANENT_ERRORS)
+
+
+class CircuitBreaker:
+    """Fast-fails calls after `threshold` consecutive upstream failures.
+
+    While open, `allow()` is False for `reset_after` seconds; afterwards a
+    single probe call is let through (half-open) and its result decides
+    whether the breaker closes or opens again. Other calls keep failing fast
+    until the probe has finished; a probe that ends without a result (e.g.
+    cancelled) must be handed back with `release_probe()`.
+    """
+
+    def __init__(self, threshold: int = 5, reset_after: float = 60.0):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'open' if self.is_open() else 'half-open'
+
+    def is_open(self) -> bool:
+        """True while calls are rejected without a probe being admitted."""
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_after
+
+    def allow(self) -> bool:
+        """Whether a call may proceed; in half-open state this admits the probe."""
+        if self.opened_at is None:
+            return True
+        if self.is_open() or self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def release_probe(self):
+        self.probing = False
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_after - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.threshold and self.failures >= self.threshold:
+            if not self.is_open():
+                log.warning('Circuit breaker open after %d consecutive failures', self.failures)
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+
+# one YoutubeDL per worker thread/process; instances are not shared between threads
+_local = threading.local()
+
+
+def _get_ytdl(flat: bool) -> yt_dlp.YoutubeDL:
+    name = 'flat' if flat else 'video'
+    ytdl = getattr(_local, name, None)
+    if ytdl is None:
+        ytdl = yt_dlp.YoutubeDL(YTDL_FLAT_OPTS if flat else YTDL_OPTS)
+        setattr(_local, name, ytdl)
+    return ytdl
+
+
+def compact_track(info: dict | None) -> dict | None:
+    """Reduce a full yt-dlp info dict to the fields the bot uses."""
+    if not info:
+        return None
+    if 'entries' in info:
+        entries = [e for e in info['entries'] or [] if e]
+        if not entries:
+            return None
+        entry = entries[0]
+    else:
+        entry = info
+
+    # the format yt-dlp selected ('bestaudio/best') is merged into the info
+    # dict; for merged selections it is the audio part of requested_formats
+    fmt = entry
+    if not entry.get('url'):
+        requested = [f for f in entry.get('requested_formats') or [] if f.get('url')]
+        audio = [f for f in requested if f.get('vcodec') == 'none' and f.get('acodec') != 'none']
+        if audio or requested:
+            fmt = (audio or requested)[0]
+        else:
+            # last resort: best audio-only format (yt-dlp sorts worst to best)
+            for f in reversed(entry.get('formats') or []):
+                if f.get('vcodec') == 'none' and f.get('acodec') != 'none' and f.get('url'):
+                    fmt = f
+                    break
+    url = fmt.get('url')
+
+    return {
+        'id': entry.get('id'),
+        'title': entry.get('title') or entry.get('id'),
+        'url': url,
+        'webpage_url': entry.get('webpage_url'),
+        'duration': entry.get('duration'),
+        'acodec': fmt.get('acodec'),
+        'ext': fmt.get('ext'),
+        'abr': fmt.get('abr'),
+    }
+
+
+def compact_playlist(info: dict | None) -> list:
+    """Reduce a flat playlist listing to `title`/`webpage_url` entries."""
+    if not info:
+        return []
+    results = []
+    for e in info.get('entries') or []:
+        if not e:
+            continue
+        page = e.get('webpage_url') or e.get('url')
+        if page and not page.startswith('http') and e.get('id'):
+            page = f"https://www.youtube.com/watch?v={e['id']}"
+        if not page:
+            continue
+        results.append({'title': e.get('title') or e.get('id'), 'webpage_url': page, 'duration': e.get('duration')})
+    return results
+
+
+def run_job(target: str, flat: bool = False):
+    """Worker entry point: extract `target` and return a compact, picklable result."""
+    try:
+        info = _get_ytdl(flat).extract_info(target, download=False)
+    except Exception as e:
+        # yt-dlp exceptions do not always survive pickling; send the message only
+        raise ExtractionError(str(e)) from None
+    return compact_playlist(info) if flat else compact_track(info)
+
+
+class ExtractionEngine:
+    """Bounded pool that runs extraction jobs off the event loop.
+
+    With `workers > 0` jobs run in separate processes, each holding its own
+    YoutubeDL, so parsing does not compete with the gateway/voice threads for
+    the GIL; the pool is replaced after `max_jobs_per_worker` jobs per worker
+    to contain memory growth. With `workers == 0` a private thread pool is used instead.
+    At most `workers + max_queue` jobs are admitted at once; further callers
+    wait for a slot. Only as many jobs as there are workers are handed to the
+    pool, so a submitted job starts running right away.
+
+    Every job has a deadline of `timeout` seconds (including time spent
+    waiting for a slot and retries). Transient failures are retried up to
+    `retries` times with exponential backoff, and a CircuitBreaker fast-fails
+    jobs with ExtractionUnavailable while upstream keeps erroring; a job
+    counts as one breaker failure once its retries are exhausted. A timeout
+    only counts when the job had been running in a worker for at least half
+    its timeout: waiting behind other jobs is local congestion, not an
+    upstream failure. Such a hung job takes its pool with it (workers are
+    terminated, threads left to finish), so it does not hold up later jobs.
+
+    `on_latency(seconds)`, if set, is called with the wall time of every job
+    that got past the breaker (including retries), successful or not.
+    """
+
+    def __init__(self, workers: int = 2, max_jobs_per_worker: int = 200, max_queue: int = 64, threads: int = 4,
+                 timeout: float = 30.0, retries: int = 2, backoff: float = 1.0,
+                 breaker_threshold: int = 5, breaker_reset: float = 60.0, on_latency=None):
+        self.workers = workers
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_queue = max_queue
+        self.threads = threads
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self.pending = 0
+        self.on_latency = on_latency
+        self._executor = None
+        self._jobs = 0
+        self._slots: asyncio.Semaphore | None = None
+        self._running: asyncio.Semaphore | None = None
+
+    def _get_executor(self):
+        if self.workers > 0 and self.max_jobs_per_worker and self._jobs >= self.workers * self.max_jobs_per_worker:
+            # recycle: new jobs go to fresh processes, the old pool finishes its
+            # running jobs and exits (max_tasks_per_child can deadlock on 3.11)
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._executor is None:
+            self._jobs = 0
+            if self.workers > 0:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='extract')
+        self._jobs += 1
+        return self._executor
+
+    def _discard(self, executor):
+        """Stop using `executor`; the next job starts a fresh pool."""
+        if self._executor is executor:
+            self._executor = None
+        processes = list((getattr(executor, '_processes', None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        # a hung worker never picks up another job; threads cannot be killed
+        # and exit once yt-dlp gives up (socket_timeout)
+        for p in processes:
+            p.terminate()
+
+    async def _submit(self, executor, target: str, flat: bool):
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, run_job, target, flat)
+        except BrokenExecutor as e:
+            # a worker died (e.g. OOM killed); start a fresh pool for the next job
+            if self._executor is executor:
+                self._executor = None
+            raise ExtractionError(f'Extraction worker crashed: {e}') from None
+
+    async def run(self, target: str, flat: bool = False, timeout: float | None = None):
+        """Run one extraction job and return its compact result.
+
+        Raises ExtractionTimeout when the deadline passes, ExtractionUnavailable
+        while the circuit breaker is open and ExtractionError otherwise.
+        """
+        # in half-open state only the probe gets past this point
+        probe = self.breaker.opened_at is not None
+        if not self.breaker.allow():
+            raise ExtractionUnavailable(
+                f'YouTube is not responding right now, try again in {int(self.breaker.retry_after()) + 1}s.'
+            )
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(max(1, self.workers or self.threads) + self.max_queue)
+            self._running = asyncio.Semaphore(max(1, self.workers or self.threads))
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        budget = timeout or self.timeout
+        deadline = started + budget
+        attempt = 0
+        self.pending += 1
+        try:
+            while True:
+                executor = running_since = None
+                try:
+                    async with asyncio.timeout_at(deadline):
+                        async with self._slots, self._running:
+                            executor = self._get_executor()
+                            running_since = loop.time()
+                            result = await self._submit(executor, target, flat)
+                    self.breaker.record_success()
+                    return result
+                except TimeoutError:
+                    if running_since is None or loop.time() - running_since < budget / 2:
+                        # (almost) all of the time went to waiting for a worker:
+                        # the bot is busy, upstream is not to blame
+                        raise ExtractionTimeout(f'Extraction timed out waiting for a free worker: {target}') from None
+                    self.breaker.record_failure()
+                    self._discard(executor)
+                    raise ExtractionTimeout(f'Extraction timed out: {target}') from None
+                except ExtractionError as e:
+                    if is_permanent_error(e):
+                        # upstream answered, the video itself is the problem
+                        self.breaker.record_success()
+                        raise
+                    delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                    if attempt >= self.retries or self.breaker.is_open() or loop.time() + delay >= deadline:
+                        self.breaker.record_failure()
+                        raise
+                    attempt += 1
+                    log.info('Retry %d/%d for %s in %.1fs: %s', attempt, self.retries, target, delay, e)
+                    await asyncio.sleep(delay)
+        finally:
+            if probe:
+                # cancelled probes hand the half-open slot to the next caller
+                self.breaker.release_probe()
+            self.pending -= 1
+            if self.on_latency is not None:
+                self.on_latency(loop.time() - started)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,94 @@
+"""Background loudness measurement for volume normalization."""
+import asyncio
+import json
+import logging
+import shutil
+
+log = logging.getLogger('bot.loudness')
+
+
+def gain_db(integrated: float, peak: float, target: float, ceiling: float, max_gain: float) -> float:
+    """Gain that moves `integrated` LUFS to `target`.
+
+    Boosts are capped at `max_gain` and must not push the true peak above
+    `ceiling` dBTP; cuts are applied as measured.
+    """
+    gain = target - integrated
+    if gain > 0:
+        gain = min(gain, max(0.0, ceiling - peak), max_gain)
+    return gain
+
+
+class LoudnessAnalyzer:
+    """Measures integrated loudness (EBU R128) once per video ID.
+
+    `analyze()` decodes the whole track with FFmpeg's loudnorm filter in
+    measurement mode and stores integrated loudness and true peak in the
+    track cache (`TrackCache.put_loudness`). It is meant as a background
+    task: FFmpeg runs single-threaded under `nice`, at most `analyses` at a
+    time, and at most `max_pending` tracks wait. Playback turns a stored
+    measurement into a fixed gain (`gain_db`), i.e. a single volume filter
+    instead of a per-play two-pass analysis.
+    """
+
+    def __init__(self, cache, analyses: int = 1, max_pending: int = 100, ffmpeg: str = 'ffmpeg'):
+        self.cache = cache
+        self.max_pending = max_pending
+        self.ffmpeg = ffmpeg
+        self._slots = asyncio.Semaphore(max(1, analyses))
+        self._pending: set[str] = set()
+        nice = shutil.which('nice')
+        # below the playback FFmpeg processes
+        self._prefix = [nice, '-n', '19'] if nice else []
+
+    async def measured(self, video_id: str | None) -> tuple[float, float] | None:
+        """(integrated LUFS, true peak dBTP) of `video_id`, or None."""
+        if not video_id:
+            return None
+        # the track cache blocks on SQLite
+        return await asyncio.to_thread(self.cache.loudness, video_id)
+
+    async def wants(self, video_id: str | None) -> bool:
+        """Whether `video_id` should be analyzed now."""
+        if not video_id or video_id in self._pending or len(self._pending) >= self.max_pending:
+            return False
+        return await self.measured(video_id) is None
+
+    async def analyze(self, video_id: str, url: str):
+        """Measure `url` (stream URL or local file) and store the result."""
+        if video_id in self._pending:
+            return
+        self._pending.add(video_id)
+        try:
+            async with self._slots:
+                reconnect = ['-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5'] \
+                    if url.startswith(('http://', 'https://')) else []
+                proc = await asyncio.create_subprocess_exec(
+                    *self._prefix, self.ffmpeg, '-nostdin', '-hide_banner', '-nostats', '-threads', '1',
+                    *reconnect, '-i', url, '-vn', '-map', '0:a:0',
+                    '-af', 'loudnorm=print_format=json', '-f', 'null', '-',
+                    stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+                )
+                try:
+                    _, err = await proc.communicate()
+                except asyncio.CancelledError:
+                    proc.kill()
+                    await proc.wait()
+                    raise
+            text = err.decode(errors='replace')
+            if proc.returncode != 0:
+                raise RuntimeError(text.strip()[-300:] or f'exit {proc.returncode}')
+            # loudnorm prints its measurement as the last JSON object
+            stats = json.loads(text[text.rindex('{'):text.rindex('}') + 1])
+            integrated, peak = float(stats['input_i']), float(stats['input_tp'])
+            if integrated == float('-inf'):
+                # silence: nothing to normalize
+                return
+            await asyncio.to_thread(self.cache.put_loudness, video_id, integrated, peak)
+            log.info('Measured %s: %.1f LUFS, %.1f dBTP', video_id, integrated, peak, extra={'track': video_id})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning('Loudness analysis failed for %s: %s', video_id, e, extra={'track': video_id})
+        finally:
+            self._pending.discard(video_id)
@@ -1,17 +1,160 @@
-import requests
+import json
+import logging
 import re
+import time
+from collections import OrderedDict
+
+import aiohttp
+
+log = logging.getLogger('bot.spotify')
+
+OEMBED_URL = 'https://open.spotify.com/oembed'
+EMBED_BASE = 'https://open.spotify.com/embed'
+
+_SPOTIFY_RE = re.compile(r"open\.spotify\.com/(?:intl-[\w-]+/)?(track|album|playlist)/([A-Za-z0-9]+)")
+_NEXT_DATA_RE = re.compile(r'<script id="__NEXT_DATA__" type="application/json">(.*?)</script>', re.S)
 
 
 def is_spotify_url(text: str) -> bool:
     return bool(re.search(r"open\.spotify\.com/(track|album|playlist)", text))
 
 
-def resolve_spotify_title(url: str) -> str | None:
-    """Try to resolve a Spotify URL to a human-readable title via oEmbed."""
-    try:
-        r = requests.get('https://open.spotify.com/oembed', params={'url': url}, timeout=5)
-        r.raise_for_status()
-        data = r.json()
-        return data.get('title')
-    except Exception:
+def is_spotify_collection(text: str) -> bool:
+    """True for Spotify album and playlist URLs (as opposed to single tracks)."""
+    m = _SPOTIFY_RE.search(text)
+    return bool(m) and m.group(1) in ('album', 'playlist')
+
+
+def _find_key(obj, key):
+    """Depth-first search for the first value stored under `key` in nested JSON."""
+    if isinstance(obj, dict):
+        if key in obj:
+            return obj[key]
+        values = obj.values()
+    elif isinstance(obj, list):
+        values = obj
+    else:
         return None
+    for v in values:
+        found = _find_key(v, key)
+        if found is not None:
+            return found
+    return None
+
+
+class SpotifyResolver:
+    """Non-blocking Spotify lookups over a pooled aiohttp session.
+
+    Track URLs are resolved to a title via oEmbed; album and playlist URLs are
+    expanded into per-track search terms using the public embed page. Results
+    are cached in memory for `cache_ttl` seconds. The endpoints are
+    configurable so the resolver can be pointed at a local stand-in server.
+    """
+
+    def __init__(self, oembed_url: str = OEMBED_URL, embed_base: str = EMBED_BASE, timeout: float = 5,
+                 cache_ttl: float = 3600, cache_size: int = 1024, max_connections: int = 10):
+        self.oembed_url = oembed_url
+        self.embed_base = embed_base.rstrip('/')
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.max_connections = max_connections
+        self._session: aiohttp.ClientSession | None = None
+        self._cache: OrderedDict[str, tuple[float, object]] = OrderedDict()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    def _cache_get(self, key: str):
+        item = self._cache.get(key)
+        if not item:
+            return None
+        if item[0] < time.monotonic():
+            self._cache.pop(key, None)
+            return None
+        self._cache.move_to_end(key)
+        return item[1]
+
+    def _cache_put(self, key: str, value):
+        self._cache[key] = (time.monotonic() + self.cache_ttl, value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def resolve_title(self, url: str) -> str | None:
+        """Try to resolve a Spotify URL to a human-readable title via oEmbed."""
+        key = f'title:{url}'
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        try:
+            async with self._get_session().get(self.oembed_url, params={'url': url}) as r:
+                r.raise_for_status()
+                data = await r.json(content_type=None)
+            title = data.get('title')
+        except Exception:
+            return None
+        if title:
+            self._cache_put(key, title)
+        return title
+
+    async def resolve_tracks(self, url: str) -> list[str]:
+        """Expand an album/playlist URL into "title artist" search terms, in order."""
+        m = _SPOTIFY_RE.search(url)
+        if not m:
+            return []
+        kind, sid = m.groups()
+        if kind == 'track':
+            title = await self.resolve_title(url)
+            return [title] if title else []
+
+        key = f'{kind}:{sid}'
+        cached = self._cache_get(key)
+        if cached is not None:
+            return list(cached)
+        try:
+            async with self._get_session().get(f'{self.embed_base}/{kind}/{sid}') as r:
+                r.raise_for_status()
+                html = await r.text()
+            m2 = _NEXT_DATA_RE.search(html)
+            data = json.loads(m2.group(1)) if m2 else {}
+        except Exception as e:
+            log.warning('Failed to expand %s: %s', url, e)
+            return []
+
+        terms = []
+        for item in _find_key(data, 'trackList') or []:
+            if not isinstance(item, dict) or not item.get('title'):
+                continue
+            terms.append(' '.join(x for x in (item.get('title'), item.get('subtitle')) if x))
+        if terms:
+            self._cache_put(key, tuple(terms))
+        return terms
+
+    async def close(self):
+        """Close the pooled session; a later lookup opens a new one."""
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+
+_resolver = SpotifyResolver()
+
+
+async def resolve_spotify_title(url: str) -> str | None:
+    """Try to resolve a Spotify URL to a human-readable title via oEmbed."""
+    return await _resolver.resolve_title(url)
+
+
+async def resolve_spotify_tracks(url: str) -> list[str]:
+    """Expand a Spotify album/playlist URL into per-track search terms."""
+    return await _resolver.resolve_tracks(url)
+
+
+async def close_spotify():
+    """Close the shared resolver's HTTP session (on shutdown)."""
+    await _resolver.close()
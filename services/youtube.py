@@ -1,66 +1,224 @@
-import yt_dlp
 import asyncio
+import logging
+import re
+import time
+from urllib.parse import urlparse, parse_qs, parse_qsl, urlencode, urlunparse
 
-YTDL_OPTS = {
-    'format': 'bestaudio/best',
-    'noplaylist': True,
-    'quiet': True,
-    'no_warnings': True,
-}
+from services.engine import ExtractionEngine
 
-_ytdl = yt_dlp.YoutubeDL(YTDL_OPTS)
+log = logging.getLogger('bot.extract')
+cache_log = logging.getLogger('bot.cache')
+
+# runs the actual yt-dlp jobs; threads by default, see set_extraction_engine
+_engine = ExtractionEngine(workers=0)
+
+# re-resolve stream URLs that expire within this many seconds
+STREAM_EXPIRY_MARGIN = 300
+
+# normalized request -> in-flight extraction, shared by concurrent identical requests
+_inflight: dict[str, asyncio.Task] = {}
+# number of callers waiting on each in-flight extraction
+_waiters: dict[str, int] = {}
+# keep references to fire-and-forget prefetch tasks so they are not collected
+_prefetch_tasks: set[asyncio.Task] = set()
+
+# optional persistent metadata cache (services.cache.TrackCache), see set_track_cache
+_track_cache = None
+
+_VIDEO_ID_RE = re.compile(
+    r'(?:youtu\.be/|youtube\.com/(?:shorts/|embed/|live/|watch\?(?:[^#]*&)?v=))([A-Za-z0-9_-]{11})'
+)
+
+
+def set_extraction_engine(engine: ExtractionEngine):
+    """Replace the engine used for all extractions (e.g. a process pool)."""
+    global _engine
+    old, _engine = _engine, engine
+    if old is not engine:
+        old.shutdown()
+
+
+def extraction_pending() -> int:
+    """Number of extraction jobs currently queued or running."""
+    return _engine.pending
+
+
+def set_track_cache(cache):
+    """Install a TrackCache used by extract_youtube (None disables caching)."""
+    global _track_cache
+    _track_cache = cache
+
+
+def youtube_video_id(text: str) -> str | None:
+    """Return the video ID of a YouTube watch/short/youtu.be URL, if any."""
+    m = _VIDEO_ID_RE.search(text or '')
+    return m.group(1) if m else None
+
+
+def query_key(search: str) -> str:
+    """Normalize a search string for cache lookups (case and whitespace)."""
+    return ' '.join(search.lower().split())
+
+
+# query parameters that do not change what a URL points to
+_TRACKING_PARAMS = {'si', 'feature', 'pp', 't', 'fbclid', 'gclid', 'ab_channel'}
+
+
+def request_key(search: str) -> str:
+    """Normalize an extraction request so equivalent requests compare equal.
+
+    YouTube URL variants (youtu.be, watch?v=, shorts, tracking params) collapse
+    to the video ID; other URLs lose tracking params; searches are compared
+    case- and whitespace-insensitively.
+    """
+    search = search.strip()
+    video_id = youtube_video_id(search)
+    if video_id:
+        return f'id:{video_id}'
+    if search.startswith(('http://', 'https://')):
+        try:
+            u = urlparse(search)
+            params = [(k, v) for k, v in parse_qsl(u.query)
+                      if k not in _TRACKING_PARAMS and not k.startswith('utm_')]
+            return urlunparse(('https', u.netloc.lower(), u.path, '', urlencode(params), ''))
+        except Exception:
+            return search
+    return query_key(search)
+
+
+def stream_expiry(url: str | None) -> float | None:
+    """Return the unix timestamp a googlevideo stream URL expires at, if it has one."""
+    if not url:
+        return None
+    try:
+        values = parse_qs(urlparse(url).query).get('expire')
+        if values:
+            return float(values[0])
+        # manifest style urls carry it as a path segment: .../expire/<ts>/...
+        m = re.search(r'/expire/(\d+)', url)
+        if m:
+            return float(m.group(1))
+    except Exception:
+        pass
+    return None
+
+
+def needs_stream(track: dict, margin: float = STREAM_EXPIRY_MARGIN) -> bool:
+    """True if the track has no playable URL yet or its URL is about to expire."""
+    if not track.get('url'):
+        return True
+    expire = track.get('expire') or stream_expiry(track.get('url'))
+    return bool(expire) and expire - time.time() < margin
 
 
 async def extract_youtube(search: str):
-    """Extracts a youtube URL/title/info for a search term or direct URL."""
-    def run():
-        return _ytdl.extract_info(search, download=False)
+    """Extracts a youtube URL/title/info for a search term or direct URL.
 
-    info = await asyncio.to_thread(run)
-    if not info:
+    Concurrent identical requests (after normalization, see `request_key`)
+    share a single extraction; every caller gets its own copy of the result.
+    Raises services.engine.ExtractionError (or a subclass) on failure.
+    """
+    key = request_key(search)
+    task = _inflight.get(key)
+    if task is None or task.cancelling():
+        # never join an extraction that is being cancelled
+        task = asyncio.create_task(_extract_youtube(search))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _inflight.pop(key, None) if _inflight.get(key) is t else None)
+    # shield: one waiter giving up must not cancel the extraction for the others,
+    # but once the last one is gone the extraction is cancelled as well
+    _waiters[key] = _waiters.get(key, 0) + 1
+    try:
+        info = await asyncio.shield(task)
+    except asyncio.CancelledError:
+        if _waiters.get(key) == 1 and not task.done():
+            task.cancel()
+            if _inflight.get(key) is task:
+                del _inflight[key]
+        raise
+    finally:
+        if _waiters.get(key, 1) <= 1:
+            _waiters.pop(key, None)
+        else:
+            _waiters[key] -= 1
+    return dict(info) if info else None
+
+
+async def _extract_youtube(search: str):
+    video_id = youtube_video_id(search)
+    key = None if video_id else query_key(search)
+    if _track_cache:
+        try:
+            cached = await asyncio.to_thread(_track_cache.get, query_key=key, video_id=video_id)
+        except Exception as e:
+            cache_log.warning('Lookup failed: %s', e)
+            cached = None
+        if cached:
+            if not needs_stream(cached):
+                return cached
+            # metadata is known: extracting the page directly is cheaper than a search
+            if cached.get('webpage_url'):
+                search = cached['webpage_url']
+
+    track = await _engine.run(search)
+    if not track:
         return None
+    track['expire'] = stream_expiry(track.get('url'))
+    if _track_cache:
+        try:
+            await asyncio.to_thread(_track_cache.put, track, key)
+        except Exception as e:
+            cache_log.warning('Store failed: %s', e)
+    return track
+
 
-    if 'entries' in info:
-        entry = info['entries'][0]
-    else:
-        entry = info
+async def resolve_stream(track: dict) -> str | None:
+    """Make sure `track['url']` is a fresh playable stream URL and return it.
+
+    Queued tracks may only carry a `webpage_url`; the stream URL is resolved
+    here just before it is needed, and re-resolved once it is close to expiry.
+    Concurrent calls for the same page share one extraction.
+    """
+    if not needs_stream(track):
+        return track['url']
+    page = track.get('webpage_url')
+    if not page:
+        return track.get('url')
+
+    info = await extract_youtube(page)
+    if not info or not info.get('url'):
+        return None
+    # format fields describe the stream URL, so they are always replaced with it
+    for k in ('url', 'expire', 'acodec', 'ext', 'abr'):
+        track[k] = info.get(k)
+    for k in ('id', 'title', 'duration'):
+        if not track.get(k):
+            track[k] = info.get(k)
+    return track['url']
 
-    url = None
-    if 'formats' in entry and entry['formats']:
-        for f in reversed(entry['formats']):
-            if f.get('acodec') != 'none' and f.get('url'):
-                url = f['url']
-                break
-    if not url and entry.get('url'):
-        url = entry['url']
 
-    title = entry.get('title') or entry.get('id')
+def prefetch_streams(tracks, ahead: int = 2):
+    """Start resolving stream URLs for the next `ahead` tracks in the background."""
+    async def run(track):
+        try:
+            await resolve_stream(track)
+        except Exception as e:
+            log.warning('Prefetch failed for %s: %s', track.get('webpage_url'), e, extra={'track': track.get('webpage_url')})
 
-    return {'title': title, 'url': url, 'webpage_url': entry.get('webpage_url')}
+    for i, track in enumerate(tracks):
+        if i >= ahead:
+            break
+        page = track.get('webpage_url')
+        if needs_stream(track) and page and request_key(page) not in _inflight:
+            t = asyncio.create_task(run(track))
+            _prefetch_tasks.add(t)
+            t.add_done_callback(_prefetch_tasks.discard)
 
 
-async def extract_playlist(playlist_url: str):
-    """Extract entries from a YouTube playlist URL and return list of track dicts.
+async def extract_playlist_entries(playlist_url: str):
+    """Flat-list a playlist without resolving the individual videos.
 
-    Each track dict has `title`, `url` (direct playable url), and `webpage_url`.
+    Returns a list of dicts with `title` and `webpage_url`; this is a single
+    request regardless of playlist size.
     """
-    def run():
-        return _ytdl.extract_info(playlist_url, download=False)
-
-    info = await asyncio.to_thread(run)
-    if not info:
-        return []
-
-    entries = info.get('entries') or []
-    results = []
-    for e in entries:
-        # prefer webpage_url if present
-        page = e.get('webpage_url') or e.get('url')
-        if not page:
-            continue
-        # reuse extract_youtube to get playable url and title
-        track = await extract_youtube(page)
-        if track:
-            results.append(track)
-
-    return results
+    return await _engine.run(playlist_url, flat=True)
@@ -1,11 +1,212 @@
+"""settings.TOML loading: a validated, immutable snapshot with all defaults."""
+import logging
 import tomllib
+import types
+from dataclasses import dataclass, field, fields
+from types import MappingProxyType
+from typing import Mapping
 
-def load_settings():
+SETTINGS_PATH = 'settings.TOML'
+
+
+class SettingsError(ValueError):
+    """settings.TOML has a value of the wrong type."""
+
+
+@dataclass(frozen=True, slots=True)
+class BotSettings:
+    token: str = ''
+    prefix: str = '/'
+    test_guild_id: int | None = None
+    application_id: int | None = None
+    force_command_sync: bool = False
+    idle_timeout: int = 120
+    pause_idle_timeout: int = 300
+    skip_required: int = 1
+    skip_use_majority: bool = False
+    prefetch_ahead: int = 2
+    prewarm_seconds: float = 0.0
+    opus_passthrough: bool = True
+    message_update_interval: float = 1.0
+    spotify_concurrency: int = 4
+    settings_reload_interval: float = 5.0
+
+
+@dataclass(frozen=True, slots=True)
+class CacheSettings:
+    enabled: bool = True
+    path: str = 'cache/tracks.sqlite3'
+    ttl: int = 7 * 24 * 3600
+    max_entries: int = 50000
+
+
+@dataclass(frozen=True, slots=True)
+class AudioCacheSettings:
+    enabled: bool = False
+    path: str = 'cache/audio'
+    max_size_mb: float = 2048.0
+    min_plays: int = 3
+    downloads: int = 1
+
+
+@dataclass(frozen=True, slots=True)
+class JournalSettings:
+    enabled: bool = True
+    path: str = 'cache/queues.journal'
+    compact_every: int = 5000
+    restore_concurrency: int = 4
+
+
+@dataclass(frozen=True, slots=True)
+class LoudnessSettings:
+    enabled: bool = False
+    # LUFS
+    target: float = -14.0
+    # dBTP a boost may raise the true peak to
+    true_peak: float = -1.0
+    # dB
+    max_gain: float = 10.0
+    min_gain: float = 1.0
+    analyses: int = 1
+    # seconds; longer tracks and live streams are not analyzed
+    max_duration: float = 900.0
+
+
+@dataclass(frozen=True, slots=True)
+class ExtractionSettings:
+    workers: int = 2
+    max_jobs_per_worker: int = 200
+    max_queue: int = 64
+    timeout: float = 30.0
+    retries: int = 2
+    backoff: float = 1.0
+    breaker_threshold: int = 5
+    breaker_reset: float = 60.0
+
+
+@dataclass(frozen=True, slots=True)
+class ShardingSettings:
+    enabled: bool = False
+    shard_count: int = 0
+    clusters: int = 1
+    status_interval: float = 30.0
+
+
+@dataclass(frozen=True, slots=True)
+class MetricsSettings:
+    enabled: bool = False
+    host: str = '127.0.0.1'
+    port: int = 9108
+
+
+@dataclass(frozen=True, slots=True)
+class LoggingSettings:
+    format: str = 'text'
+    level: str = 'INFO'
+    discord_level: str = 'INFO'
+    # subsystem -> level
+    levels: Mapping[str, str] = field(default_factory=lambda: MappingProxyType({}))
+
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    bot: BotSettings = BotSettings()
+    cache: CacheSettings = CacheSettings()
+    audio_cache: AudioCacheSettings = AudioCacheSettings()
+    journal: JournalSettings = JournalSettings()
+    loudness: LoudnessSettings = LoudnessSettings()
+    extraction: ExtractionSettings = ExtractionSettings()
+    sharding: ShardingSettings = ShardingSettings()
+    metrics: MetricsSettings = MetricsSettings()
+    logging: LoggingSettings = LoggingSettings()
+    # command -> prefix aliases (lower case)
+    commands: Mapping[str, tuple[str, ...]] = field(default_factory=lambda: MappingProxyType({}))
+
+
+def _coerce(tp, value, key: str):
+    if isinstance(tp, types.UnionType):
+        # `X | None`: empty values mean "not set"
+        if value in ('', None):
+            return None
+        tp = next(t for t in tp.__args__ if t is not type(None))
+    if tp is bool:
+        if not isinstance(value, bool):
+            raise SettingsError(f'{key}: expected true or false, got {value!r}')
+        return value
+    if tp in (int, float):
+        if isinstance(value, bool):
+            raise SettingsError(f'{key}: expected a number, got {value!r}')
+        try:
+            return tp(value)
+        except (TypeError, ValueError):
+            raise SettingsError(f'{key}: expected a number, got {value!r}') from None
+    if tp is str:
+        return str(value)
+    if isinstance(value, dict):
+        return MappingProxyType({str(k): str(v) for k, v in value.items()})
+    raise SettingsError(f'{key}: unexpected value {value!r}')
+
+
+def _section(cls, data, name: str):
+    if data is None:
+        return cls()
+    if not isinstance(data, dict):
+        raise SettingsError(f'[{name}] must be a table')
+    values = {f.name: _coerce(f.type, data[f.name], f'{name}.{f.name}') for f in fields(cls) if f.name in data}
+    return cls(**values)
+
+
+def _logging(data) -> LoggingSettings:
+    cfg = _section(LoggingSettings, data, 'logging')
+    known = logging.getLevelNamesMapping()
+    checks = [('logging.level', cfg.level), ('logging.discord_level', cfg.discord_level)]
+    checks += [(f'logging.levels.{sub}', level) for sub, level in cfg.levels.items()]
+    for key, level in checks:
+        if level.upper() not in known:
+            raise SettingsError(f'{key}: unknown log level {level!r}')
+    return cfg
+
+
+def _aliases(commands) -> Mapping[str, tuple[str, ...]]:
+    # normalize command aliases: internal command -> aliases
+    aliases = {}
+    for k, v in (commands or {}).items():
+        if isinstance(v, str):
+            aliases[k] = (v.lower(),)
+        elif isinstance(v, list):
+            aliases[k] = tuple(str(x).lower() for x in v)
+        else:
+            # fallback: use key itself
+            aliases[k] = (k,)
+    return MappingProxyType(aliases)
+
+
+def parse_settings(data: dict) -> Settings:
+    """Validate parsed TOML and fill in defaults; raises SettingsError."""
+    return Settings(
+        bot=_section(BotSettings, data.get('bot'), 'bot'),
+        cache=_section(CacheSettings, data.get('cache'), 'cache'),
+        audio_cache=_section(AudioCacheSettings, data.get('audio_cache'), 'audio_cache'),
+        journal=_section(JournalSettings, data.get('journal'), 'journal'),
+        loudness=_section(LoudnessSettings, data.get('loudness'), 'loudness'),
+        extraction=_section(ExtractionSettings, data.get('extraction'), 'extraction'),
+        sharding=_section(ShardingSettings, data.get('sharding'), 'sharding'),
+        metrics=_section(MetricsSettings, data.get('metrics'), 'metrics'),
+        logging=_logging(data.get('logging')),
+        commands=_aliases(data.get('commands')),
+    )
+
+
+def read_settings(path: str = SETTINGS_PATH) -> Settings:
+    """Load and validate `path`; raises OSError, TOMLDecodeError or SettingsError."""
+    with open(path, 'rb') as f:
+        return parse_settings(tomllib.load(f))
+
+
+def load_settings(path: str = SETTINGS_PATH) -> Settings:
     try:
         # Load settings from TOML file
-        with open("settings.TOML", "rb") as f:
-            settings = tomllib.load(f)
-        return settings
+        return read_settings(path)
     except FileNotFoundError:
-        print("settings.TOML not found.")
-        return None
\ No newline at end of file
+        print(f"{path} not found.")
+        return Settings()